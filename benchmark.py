@@ -0,0 +1,287 @@
+# benchmark.py
+# runs whole recommendations offline against a local copy of letterboxd.com and reports how long they took,
+# how many pages they requested and how much memory they used.
+# the site is either generated (synthetic guilds of any size) or replayed from a directory of recorded pages
+# saved under their URL paths, e.g. recorded/someuser/films/page/1/index.html
+
+import os
+import sys
+import time
+import zlib
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# the bot's modules read their settings when imported, so the benchmark's settings go in first
+work_dir = tempfile.mkdtemp(prefix='letterbot_benchmark_')
+os.environ['CACHE_PATH'] = os.path.join(work_dir, 'cache.sqlite3')
+os.environ['LOG_FILE'] = os.path.join(work_dir, 'benchmark.log')
+# the local site needs no politeness, and throttling would make cold runs measure the rate limit instead of the bot
+os.environ.setdefault('LETTERBOXD_RATE', '1000000')
+os.environ.setdefault('LETTERBOXD_BURST', '1000000')
+
+FILMS_PER_PAGE = 72
+UNIVERSE_SIZE = 30000
+
+
+class Site:
+    # the pages of a fake letterboxd.com, keyed by URL path
+    def __init__(self):
+        self.pages = {}
+        # username: slugs of the films they have watched, which answers requests for a member's page of a film
+        self.watched = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def generate(self, members: int, min_films: int, max_films: int, seed: int):
+        # lists draw from a shared pool of films, favouring popular ones, so guild members overlap like real ones
+        rng = random.Random(seed)
+        universe = [(f"Film {i}", f"film-{i}") for i in range(UNIVERSE_SIZE)]
+        weights = [1 / (i + 1) for i in range(UNIVERSE_SIZE)]
+
+        if '/film/film-0/' not in self.pages:
+            for title, slug in universe:
+                # some films have no rating, which the recommendation has to drop
+                rating = 0 if rng.random() < 0.05 else round(rng.uniform(1.5, 4.5), 2)
+                self.pages[f"/film/{slug}/"] = (f'<html><head><title>{title}</title></head><body>'
+                                                f'<span class="rating">{rating}</span>'
+                                                f'<span class="runtime">{rng.randint(70, 200)}</span>'
+                                                f'<img class="poster" src="https://example.com/{slug}.jpg"/>'
+                                                f'</body></html>')
+
+        # every guild gets its own members so their lists don't overwrite another guild's
+        usernames = [f"guild{members}member{i}" for i in range(members)]
+        for username in usernames:
+            for path in ('watchlist', 'films', 'likes/films'):
+                size = rng.randint(min_films, max_films)
+                if path == 'likes/films':
+                    size //= 5
+                films = list(dict.fromkeys(rng.choices(universe, weights, k=size)))
+                self.add_list(username, path, films)
+        return usernames
+
+    def add_list(self, username: str, path: str, films: list):
+        if path == 'films':
+            self.watched[username] = set(slug for title, slug in films)
+        pages = len(films) // FILMS_PER_PAGE + 1
+        # like letterboxd.com, only lists with more than one page show pagination
+        pagination = ''
+        if pages > 1:
+            pagination = ('<div class="paginate-pages"><ul>'
+                          + ''.join(f'<li class="paginate-page"><a>{page + 1}</a></li>' for page in range(pages))
+                          + '</ul></div>')
+        for page in range(pages):
+            posters = ''.join(f'<li class="poster-container"><div class="film-poster" data-film-slug="{slug}">'
+                              f'<img class="image" alt="{title}"/></div></li>'
+                              for title, slug in films[page * FILMS_PER_PAGE:(page + 1) * FILMS_PER_PAGE])
+            self.pages[f"/{username}/{path}/page/{page + 1}/"] = (f'<html><body><ul>{posters}</ul>{pagination}'
+                                                                  f'</body></html>')
+
+    def load(self, directory: str):
+        # recorded pages, plus the usernames whose lists were recorded
+        usernames = set()
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                if name != 'index.html':
+                    continue
+                path = '/' + os.path.relpath(root, directory).replace(os.sep, '/') + '/'
+                with open(os.path.join(root, name), encoding='utf-8') as file:
+                    self.pages[path] = file.read()
+                if not path.startswith('/film/'):
+                    usernames.add(path.split('/')[1])
+        return sorted(usernames)
+
+    def serve(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with site.lock:
+                    site.requests += 1
+                # pages past the end of a list exist on letterboxd.com, they are just empty,
+                # while a member's page of a film they haven't watched doesn't exist
+                parts = self.path.strip('/').split('/')
+                status = 200
+                if self.path not in site.pages and len(parts) == 3 and parts[1] == 'film':
+                    status = 200 if parts[2] in site.watched.get(parts[0], ()) else 404
+                body = site.pages.get(self.path, '<html><body></body></html>').encode('utf-8')
+                # lets the bot revalidate pages it has stored, like letterboxd.com's ETags do
+                etag = f'"{zlib.crc32(body):08x}"'
+                if status == 200 and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class FakeFilm:
+    # stands in for letterboxdpy's Movie, reading the fake film pages
+    def __init__(self, slug: str):
+        page = scraper.get_parsed_page(f"{scraper.LETTERBOXD_URL}/film/{slug}/")
+        self.rating = f"{page.find('span', {'class': 'rating'}).text} out of 5"
+        self.runtime = page.find('span', {'class': 'runtime'}).text
+
+
+def fake_poster(slug: str) -> str:
+    page = scraper.get_parsed_page(f"{scraper.LETTERBOXD_URL}/film/{slug}/")
+    return page.find('img', {'class': 'poster'})['src']
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.mention = f"<@{user_id}>"
+
+
+class FakeResponse:
+    async def send_message(self, *args, **kwargs):
+        pass
+
+    async def defer(self, *args, **kwargs):
+        pass
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"benchmark guild {guild_id}"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeClient:
+    def get_user(self, user_id: int):
+        return FakeUser(user_id)
+
+
+class FakeMessage:
+    def __init__(self):
+        self.edits = 0
+
+    async def edit(self, *args, **kwargs):
+        self.edits += 1
+
+
+class FakeInteraction:
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        self.guild = FakeGuild(guild_id)
+        self.user = FakeUser(0)
+        self.client = FakeClient()
+        self.response = FakeResponse()
+        self.message = FakeMessage()
+
+    async def original_response(self):
+        return self.message
+
+
+class FakeVoiceChannel:
+    def __init__(self, members: list):
+        self.members = members
+
+
+async def run_recommendation(usernames: list, guild_id: int):
+    async def guild_accounts(requested_guild):
+        return [(str(i + 1), username) for i, username in enumerate(usernames)]
+    queries.guild_accounts = guild_accounts
+
+    # every other member is in the voice channel, so attendance is taken automatically
+    channel = FakeVoiceChannel([FakeUser(i + 1) for i in range(0, len(usernames), 2)])
+    interaction = FakeInteraction(guild_id)
+    recommendation = recommend.Recommendation(channel)
+    await recommendation.initiate(interaction)
+    # let the last message edit go out instead of being cancelled with the event loop
+    if recommendation.update_task is not None:
+        await recommendation.update_task
+    return recommendation, interaction
+
+
+def measure(site: Site, usernames: list, guild_id: int) -> dict:
+    requests_before = site.requests
+    tracemalloc.start()
+    start = time.perf_counter()
+    recommendation, interaction = asyncio.run(run_recommendation(usernames, guild_id))
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': seconds,
+            'requests': site.requests - requests_before,
+            'peak_mb': peak / 1024 / 1024,
+            'candidates': len(recommendation.scoring_matrix) if recommendation.scoring_matrix is not None else 0,
+            'edits': interaction.message.edits}
+
+
+def reset_cache():
+    with cache.lock:
+        if cache.connection is not None:
+            cache.connection.close()
+            cache.connection = None
+        if os.path.exists(cache.CACHE_PATH):
+            os.remove(cache.CACHE_PATH)
+
+
+def main():
+    global scraper, cache, queries, recommend
+
+    parser = argparse.ArgumentParser(description="Benchmark recommendations against a local copy of letterboxd.com")
+    parser.add_argument('--members', type=int, nargs='+', default=[2, 10, 50],
+                        help="guild sizes to benchmark")
+    parser.add_argument('--min-films', type=int, default=100, help="smallest generated list")
+    parser.add_argument('--max-films', type=int, default=5000, help="largest generated list")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fixtures', help="directory of recorded pages to replay instead of generating a site")
+    args = parser.parse_args()
+
+    site = Site()
+    server = site.serve()
+    os.environ['LETTERBOXD_URL'] = f"http://127.0.0.1:{server.server_address[1]}"
+
+    import scraper
+    import cache
+    import queries
+    import recommend
+    scraper.lb_movie.Movie = FakeFilm
+    scraper.lb_movie.movie_poster = fake_poster
+
+    if args.fixtures:
+        usernames = site.load(args.fixtures)
+        scenarios = [usernames]
+    else:
+        scenarios = []
+        for members in args.members:
+            scenarios.append(site.generate(members, args.min_films, args.max_films, args.seed + members))
+
+    print(f"{'members':>8} {'run':>5} {'seconds':>9} {'requests':>9} {'peak MB':>8} {'candidates':>11} {'edits':>6}")
+    try:
+        for guild_id, usernames in enumerate(scenarios):
+            reset_cache()
+            for run in ('cold', 'warm'):
+                result = measure(site, usernames, guild_id)
+                print(f"{len(usernames):>8} {run:>5} {result['seconds']:>9.2f} {result['requests']:>9} "
+                      f"{result['peak_mb']:>8.1f} {result['candidates']:>11} {result['edits']:>6}")
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
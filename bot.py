@@ -14,10 +14,19 @@ import mysql.connector
 import functools
 import typing
 import asyncio
+from collections import OrderedDict
 import database
+import queries
+import membership
 import log
+import transport
+import scheduler
+import prewarm
+import sessions
 from recommend import Recommendation
 
+transport.install(lb_user, lb_list, lb_movie)
+
 load_dotenv('.env')
 TOKEN = os.getenv('DISCORD_TOKEN')
 PREFIX = os.getenv('PREFIX')
@@ -27,6 +36,13 @@ client = commands.Bot(command_prefix=PREFIX, intents=discord.Intents.all())
 
 global max_recommendations
 
+# user id: discord.User for users that had to be looked up outside of the gateway cache, least recently used first
+resolved_users = OrderedDict()
+RESOLVED_USERS_MAX = 2000
+
+# guild id: whether it is a test guild. Mirrors the guilds table so commands don't need a query to check it
+guild_registry = {}
+
 
 @client.event
 async def on_ready():
@@ -41,6 +57,14 @@ async def on_ready():
     await database.connect()
     print(f'Bot has connected to the database')
 
+    # missing indexes only make lookups slower, so a failure here mustn't stop the bot from starting
+    try:
+        await queries.ensure_indexes()
+    except Exception as e:
+        await log.error(e)
+    await load_guild_registry()
+    await reconcile_memberships()
+
     if is_test:
         print('Running as a dev environment')
     else:
@@ -49,6 +73,18 @@ async def on_ready():
     # import saved data
     max_recommendations = 10
 
+    if not prewarm_loop.is_running():
+        prewarm_loop.start()
+
+
+# keeps the Letterboxd data of recently active guilds warm so recommendations rarely wait on scraping
+@tasks.loop(minutes=prewarm.INTERVAL)
+async def prewarm_loop():
+    try:
+        await prewarm.refresh()
+    except Exception as e:
+        await log.error(e)
+
 
 # sends long functions to a separate thread so the bot doesn't hang while the function is working
 def to_thread(func: typing.Callable) -> typing.Coroutine:
@@ -76,8 +112,35 @@ async def on_message(message):
         await sync_commands(message)
 
 
+@client.event
+async def on_guild_join(guild: discord.Guild):
+    await check_guild(guild)
+    # a guild the bot is rejoining is already registered, so its members are brought up to date here
+    for member in guild.members:
+        membership.add(guild.id, member.id)
+
+
+@client.event
+async def on_guild_remove(guild: discord.Guild):
+    guild_registry.pop(guild.id, None)
+    await queries.remove_guild_memberships(guild.id)
+
+
+@client.event
+async def on_member_join(member: discord.Member):
+    if member.guild.id in guild_registry:
+        membership.add(member.guild.id, member.id)
+
+
+@client.event
+async def on_member_remove(member: discord.Member):
+    if member.guild.id in guild_registry:
+        membership.remove(member.guild.id, member.id)
+
+
 async def sync_commands(message: discord.Message):
-    test_guild = await check_guild(message.guild)
+    # re-read the guild from the database, since test servers are set there manually
+    test_guild = await check_guild(message.guild, refresh=True)
     if test_guild != is_test:
         return
     print(f'\nSyncing commands...')
@@ -95,36 +158,48 @@ async def sync_commands(message: discord.Message):
         await message.reply(e.__str__())
 
 
-async def check_guild(guild: discord.Guild) -> bool:
+async def load_guild_registry():
+    guild_registry.update(await queries.guilds())
+
+
+async def reconcile_memberships():
+    # joins and leaves while the bot was offline never came in as events, so compare every registered guild's
+    # members with its stored memberships and queue the differences
+    for guild in client.guilds:
+        if guild.id not in guild_registry:
+            continue
+        try:
+            stored = set(await queries.guild_memberships(guild.id))
+        except Exception as e:
+            await log.error(e)
+            continue
+        current = set(str(member.id) for member in guild.members)
+        for member_id in current - stored:
+            membership.add(guild.id, int(member_id))
+        for member_id in stored - current:
+            membership.remove(guild.id, int(member_id))
+
+
+async def check_guild(guild: discord.Guild, refresh=False) -> bool:
     # adds the guild to the database if it isn't already then returns whether the guild is a test server
     # returns whether this is a test guild
     global is_test
-    cursor = await database.get_cursor()
-    cursor.execute(f"SELECT guild, test FROM guilds WHERE guild='{guild.id}'")
-    # should only ever be length 1 or 0
-    for item in cursor:
-        test = item[1] == 1
-        cursor.close()
+    if guild.id in guild_registry and not refresh:
+        return guild_registry[guild.id]
+
+    test = await queries.guild_test(guild.id)
+    if test is not None:
+        guild_registry[guild.id] = test
         return test
 
     # will only get here if guild was not in the database
     # always default test to 0. Manually set a test server in the database
-    cursor.execute(f"INSERT INTO guilds (guild, test) VALUES ('{guild.id}', b'0')")
-    await database.commit()
+    await queries.add_guild(guild.id)
+    guild_registry[guild.id] = False
 
     # check the guild for existing paired members and add new membership pairs if any
-    member_ids = ''
-    for member in guild.members:
-        member_ids += f"'{member.id}' , "
-    member_ids = member_ids.strip(" ,")
-    cursor.execute(f"SELECT member FROM users WHERE member IN ({member_ids})")
-    if cursor.rowcount >= 1:
-        rows = ''
-        for row in cursor.fetchall():
-            rows += f"('{guild.id}', {row[0]}), "
-        rows = rows.strip(", ")
-        cursor.execute(f"REPLACE INTO memberships (guild, member) VALUES {rows}")
-        await database.commit()
+    linked = await queries.linked_members([member.id for member in guild.members])
+    await queries.add_memberships([(guild.id, member) for member in linked])
 
     return False
 
@@ -180,6 +255,13 @@ async def slash_describer(name: str, description: str, parameters: dict = None):
     return final
 
 
+def find_letterboxd_user(username: str):
+    # blocking, so only call this from a worker thread.
+    # someone is waiting on the reply, so the lookup doesn't queue behind collections and prewarming
+    scheduler.priority.set(scheduler.INTERACTIVE)
+    return lb_user.User(username)
+
+
 @client.tree.command(name="link_account", description="Link a Letterboxd account to a discord user")
 @app_commands.describe(username="Letterboxd account username", member="Discord member")
 async def link_account(interaction: discord.Interaction, username: str, member: discord.Member = None):
@@ -204,27 +286,22 @@ async def link_account(interaction: discord.Interaction, username: str, member:
 
     is_admin = interaction.user.guild_permissions.administrator
 
-    cursor = await database.get_cursor()
-
     # only allow someone to change another user's linked account if they're an admin
     if not is_admin:
         if interaction.user != member:
             await interaction.response.send_message(f'Only an admin can link another user\'s account', ephemeral=True)
-            cursor.close()
             return
 
         # don't let user change their account if they already have one linked and aren't an admin
-        cursor.execute(f"SELECT member FROM users WHERE member='{member.id}'")
-        if cursor.rowcount >= 1:
+        if await queries.user_by_member(member.id) is not None:
             await interaction.response.send_message(f'Letterboxd account already linked.\n'
                                                     f'Ask an admin to change your account if it is incorrect',
                                                     ephemeral=True)
-            cursor.close()
             return
 
     # make sure Letterboxd user exists
     try:
-        user = lb_user.User(username)
+        user = await asyncio.to_thread(find_letterboxd_user, username)
         # set username to the capitalization of the official online account
         username = user.username
     except Exception as e:
@@ -239,43 +316,21 @@ async def link_account(interaction: discord.Interaction, username: str, member:
             return
 
     # make sure Letterboxd account hasn't already been paired to a member
-    cursor.execute(f"SELECT account FROM users WHERE account='{username}'")
-    for item in cursor:
+    if await queries.user_by_account(username) is not None:
         await interaction.response.send_message(f'This Letterboxd account is '
                                                 f'already linked to another Discord user', ephemeral=True)
-        cursor.close()
         return
 
     # otherwise link account
-    else:
-        cursor.execute(f"REPLACE INTO users (member, account) VALUES "
-                       f"('{member.id}','{username}')")
-        await database.commit()
-
-        # reconnect to db so the child table sees the newly added and required parent table entry
-        cursor.close()
-        await database.connect()
-        cursor = await database.get_cursor()
-
-        # create a membership for the member for all registered guilds
-        cursor.execute(f"SELECT guild FROM guilds")
-        rows = ''
-        for row in cursor:
-            if client.get_guild(int(row[0])).get_member(member.id) is not None:
-                rows += f"({row[0]},'{member.id}'), "
-        rows = rows.strip(", ")
-
-        cursor.execute(f"\nREPLACE INTO memberships (guild, member) VALUES "
-                       f"{rows}")
-        await database.commit()
-
-        await interaction.response.send_message(f'{member.display_name} '
-                                                f'was linked to the Letterboxd account "{username}"',
-                                                ephemeral=True)
-        cursor.close()
-        return
+    await queries.link_user(member.id, username)
+
+    # create a membership for the member in every registered guild they share with the bot
+    await queries.add_memberships([(guild.id, member.id) for guild in member.mutual_guilds
+                                   if guild.id in guild_registry])
 
-    cursor.close()
+    await interaction.response.send_message(f'{member.display_name} '
+                                            f'was linked to the Letterboxd account "{username}"',
+                                            ephemeral=True)
     return
 
 
@@ -301,18 +356,13 @@ async def clear_link(interaction: discord.Interaction, member: discord.Member):
                                                 ephemeral=True)
         return
 
-    cursor = await database.get_cursor()
-    cursor.execute(f"SELECT member FROM users WHERE member='{member.id}'")
-    if cursor.rowcount <= 0:
+    if await queries.user_by_member(member.id) is None:
         await interaction.response.send_message(f'This user does not have a paired Letterboxd account',
                                                 ephemeral=True)
-        cursor.close()
         return
-    cursor.execute(f"DELETE FROM users WHERE member='{member.id}'")
-    await database.commit()
+    await queries.unlink_user(member.id)
     await interaction.response.send_message(f'Successfully removed {member.mention} '
                                             f'and their paired Letterboxd account', ephemeral=True)
-    cursor.close()
     return
 
 
@@ -326,29 +376,61 @@ async def display_members(interaction: discord.Interaction):
 
     await log.slash(interaction.user, "display_members", interaction.guild)
 
-    cursor = await database.get_cursor()
-    cursor.execute(f"SELECT users.member, users.account FROM users, memberships "
-                   f"WHERE memberships.guild='{interaction.guild_id}' AND users.member=memberships.member "
-                   f"ORDER BY account")
-    if cursor.rowcount <= 0:
+    linked = await queries.guild_accounts(interaction.guild_id)
+    if len(linked) <= 0:
         await interaction.response.send_message(f"No linked members in this discord server", ephemeral=True)
-        cursor.close()
         return
 
+    # resolving members can take longer than the interaction deadline on large guilds
+    await interaction.response.defer()
+    users = await resolve_users(interaction.guild, [int(item[0]) for item in linked])
+
     members = ''
     accounts = ''
-    for item in cursor:
-        members += f'{(await client.fetch_user(int(item[0]))).mention}\n'
+    for item in linked:
+        members += f'{users[int(item[0])].mention}\n'
         accounts += f'[{str(item[1])}](https://letterboxd.com/{str(item[1])}/)\n'
 
     final = discord.Embed(title='**LINKED ACCOUNTS IN THIS SERVER**')
     final.add_field(name='Discord Member', value=members)
     final.add_field(name='Letterboxd Account', value=accounts)
-    await interaction.response.send_message(embed=final)
-    cursor.close()
+    await interaction.followup.send(embed=final)
     return
 
 
+async def resolve_users(guild: discord.Guild, user_ids: list) -> dict:
+    # user id: discord.User or discord.Member, using as few Discord requests as possible
+    users = {}
+    missing = []
+    for user_id in user_ids:
+        member = guild.get_member(user_id)
+        if member is not None:
+            users[user_id] = member
+        elif user_id in resolved_users:
+            resolved_users.move_to_end(user_id)
+            users[user_id] = resolved_users[user_id]
+        else:
+            missing.append(user_id)
+
+    # members missing from the gateway cache are requested from the gateway 100 at a time
+    found = []
+    for i in range(0, len(missing), 100):
+        found += await guild.query_members(user_ids=missing[i:i + 100], limit=100)
+
+    # anyone left has left the guild, so they can only be fetched one at a time
+    found_ids = set(member.id for member in found)
+    for user_id in missing:
+        if user_id not in found_ids:
+            found.append(await client.fetch_user(user_id))
+
+    for user in found:
+        users[user.id] = user
+        resolved_users[user.id] = user
+        if len(resolved_users) > RESOLVED_USERS_MAX:
+            resolved_users.popitem(last=False)
+    return users
+
+
 @to_thread
 @client.tree.command(name="recommend", description="Recommend a movie based on present members' "
                                                    "watch-lists and absent members' watched-lists")
@@ -364,9 +446,20 @@ async def recommend(interaction: discord.Interaction,
 
     await log.slash(interaction.user, "recommend", interaction.guild,
                     {'channel_for_attendance': channel_for_attendance})
+    await prewarm.mark_used(interaction.guild_id)
+
+    if not sessions.can_start(interaction.guild_id, max_recommendations):
+        await interaction.response.send_message(f'Too many recommendations are already running. '
+                                                f'Please finish or wait out an existing one', ephemeral=True)
+        return
 
     recommendation = Recommendation(channel_for_attendance)
-    await recommendation.initiate(interaction)
+    sessions.register(interaction.guild_id, recommendation)
+    try:
+        await recommendation.initiate(interaction)
+    except Exception:
+        await recommendation.close()
+        raise
 
     return
 
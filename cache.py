@@ -0,0 +1,214 @@
+# cache.py
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+load_dotenv('.env')
+CACHE_PATH = os.getenv('CACHE_PATH', 'letterbot_cache.sqlite3')
+# seconds a scraped Letterboxd list stays fresh
+PROFILE_TTL = float(os.getenv('PROFILE_CACHE_TTL', 6 * 60 * 60))
+# most (account, list type) entries kept before the least recently used ones are evicted
+PROFILE_MAX_ENTRIES = int(os.getenv('PROFILE_CACHE_MAX_ENTRIES', 5000))
+# seconds before a film's stored rating, runtime and poster are fetched again
+FILM_TTL = float(os.getenv('FILM_CACHE_TTL', 7 * 24 * 60 * 60))
+# most pages kept for revalidating with letterboxd.com before the least recently stored ones are evicted
+RESPONSE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 2000))
+
+# the cache is used from the scraping worker threads, so every access goes through this lock
+lock = threading.RLock()
+connection: sqlite3.Connection = None
+
+hits = 0
+misses = 0
+film_hits = 0
+film_misses = 0
+
+
+def connect():
+    global connection
+
+    with lock:
+        if connection is None:
+            connection = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+            connection.execute("CREATE TABLE IF NOT EXISTS profile_lists ("
+                               "account TEXT NOT NULL, "
+                               "list_type TEXT NOT NULL, "
+                               "films TEXT NOT NULL, "
+                               "fetched_at REAL NOT NULL, "
+                               "used_at REAL NOT NULL, "
+                               "full_sync_at REAL NOT NULL DEFAULT 0, "
+                               "PRIMARY KEY (account, list_type))")
+            # caches made before incremental syncing have no full_sync_at column
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(profile_lists)")]
+            if 'full_sync_at' not in columns:
+                connection.execute("ALTER TABLE profile_lists ADD COLUMN full_sync_at REAL NOT NULL DEFAULT 0")
+            connection.execute("CREATE INDEX IF NOT EXISTS profile_lists_used ON profile_lists (used_at)")
+            connection.execute("CREATE TABLE IF NOT EXISTS films ("
+                               "slug TEXT PRIMARY KEY, "
+                               "title TEXT NOT NULL, "
+                               "rating REAL NOT NULL, "
+                               "runtime INTEGER, "
+                               "poster TEXT, "
+                               "fetched_at REAL NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                               "url TEXT PRIMARY KEY, "
+                               "etag TEXT, "
+                               "last_modified TEXT, "
+                               "content_type TEXT, "
+                               "encoding TEXT, "
+                               "body BLOB NOT NULL, "
+                               "stored_at REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_stored ON responses (stored_at)")
+            connection.execute("CREATE TABLE IF NOT EXISTS guild_activity ("
+                               "guild TEXT PRIMARY KEY, "
+                               "used_at REAL NOT NULL)")
+            connection.commit()
+        return connection
+
+
+def get_list(account: str, list_type: str):
+    # returns the cached list of (title, slug) films, or None if it is missing or older than the TTL
+    global hits
+    global misses
+
+    with lock:
+        db = connect()
+        row = db.execute("SELECT films, fetched_at FROM profile_lists WHERE account=? AND list_type=?",
+                         (account.lower(), list_type)).fetchone()
+        if row is None or time.time() - row[1] > PROFILE_TTL:
+            misses += 1
+            return None
+
+        hits += 1
+        db.execute("UPDATE profile_lists SET used_at=? WHERE account=? AND list_type=?",
+                   (time.time(), account.lower(), list_type))
+        db.commit()
+    return [tuple(film) for film in json.loads(row[0])]
+
+
+def get_snapshot(account: str, list_type: str):
+    # returns the last stored version of a list no matter how old it is, for incremental syncing
+    with lock:
+        row = connect().execute("SELECT films, fetched_at, full_sync_at FROM profile_lists "
+                                "WHERE account=? AND list_type=?",
+                                (account.lower(), list_type)).fetchone()
+    if row is None:
+        return None
+    return {'films': [tuple(film) for film in json.loads(row[0])],
+            'fetched_at': row[1],
+            'full_sync_at': row[2]}
+
+
+def put_list(account: str, list_type: str, films: list, full_sync=True):
+    now = time.time()
+    with lock:
+        db = connect()
+        full_sync_at = now
+        if not full_sync:
+            row = db.execute("SELECT full_sync_at FROM profile_lists WHERE account=? AND list_type=?",
+                             (account.lower(), list_type)).fetchone()
+            full_sync_at = 0 if row is None else row[0]
+
+        db.execute("REPLACE INTO profile_lists (account, list_type, films, fetched_at, used_at, full_sync_at) "
+                   "VALUES (?, ?, ?, ?, ?, ?)",
+                   (account.lower(), list_type, json.dumps(films), now, now, full_sync_at))
+
+        # evict the least recently used lists once the cache grows past its bound
+        db.execute("DELETE FROM profile_lists WHERE rowid IN ("
+                   "SELECT rowid FROM profile_lists ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                   (PROFILE_MAX_ENTRIES,))
+        db.commit()
+
+
+def get_films(slugs) -> dict:
+    # bulk lookup of the films that are stored and still fresh, as slug: {title, rating, runtime, poster}
+    global film_hits
+    global film_misses
+
+    slugs = list(slugs)
+    films = {}
+    oldest = time.time() - FILM_TTL
+    with lock:
+        db = connect()
+        # stay well under sqlite's limit on query parameters
+        for i in range(0, len(slugs), 500):
+            chunk = slugs[i:i + 500]
+            rows = db.execute(f"SELECT slug, title, rating, runtime, poster FROM films "
+                              f"WHERE fetched_at>? AND slug IN ({', '.join('?' * len(chunk))})",
+                              [oldest] + chunk)
+            for row in rows:
+                films[row[0]] = {'title': row[1], 'rating': row[2], 'runtime': row[3], 'poster': row[4]}
+        film_hits += len(films)
+        film_misses += len(slugs) - len(films)
+    return films
+
+
+def put_film(slug: str, title: str, rating: float, runtime, poster=None):
+    with lock:
+        db = connect()
+        # keep an already fetched poster, since posters are fetched separately from the rest of the data
+        if poster is None:
+            row = db.execute("SELECT poster FROM films WHERE slug=?", (slug,)).fetchone()
+            poster = None if row is None else row[0]
+        db.execute("REPLACE INTO films (slug, title, rating, runtime, poster, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                   (slug, title, rating, runtime, poster, time.time()))
+        db.commit()
+
+
+def put_poster(slug: str, poster: str):
+    with lock:
+        db = connect()
+        db.execute("UPDATE films SET poster=? WHERE slug=?", (poster, slug))
+        db.commit()
+
+
+def get_response(url: str):
+    # the last stored copy of a page with the validators it was sent with, or None
+    with lock:
+        row = connect().execute("SELECT etag, last_modified, content_type, encoding, body FROM responses WHERE url=?",
+                                (url,)).fetchone()
+    if row is None:
+        return None
+    return {'etag': row[0], 'last_modified': row[1], 'content_type': row[2], 'encoding': row[3],
+            'body': zlib.decompress(row[4])}
+
+
+def put_response(url: str, etag, last_modified, content_type, encoding, body: bytes):
+    with lock:
+        db = connect()
+        db.execute("REPLACE INTO responses (url, etag, last_modified, content_type, encoding, body, stored_at) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                   (url, etag, last_modified, content_type, encoding, zlib.compress(body), time.time()))
+        db.execute("DELETE FROM responses WHERE rowid IN ("
+                   "SELECT rowid FROM responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                   (RESPONSE_MAX_ENTRIES,))
+        db.commit()
+
+
+def mark_guild_used(guild_id):
+    with lock:
+        db = connect()
+        db.execute("REPLACE INTO guild_activity (guild, used_at) VALUES (?, ?)", (str(guild_id), time.time()))
+        db.commit()
+
+
+def recent_guilds(since: float) -> list:
+    # guilds that used the bot after `since`, most recent first
+    with lock:
+        rows = connect().execute("SELECT guild FROM guild_activity WHERE used_at>? ORDER BY used_at DESC",
+                                 (since,)).fetchall()
+    return [row[0] for row in rows]
+
+
+def stats():
+    with lock:
+        db = connect()
+        entries = db.execute("SELECT COUNT(*) FROM profile_lists").fetchone()[0]
+        films = db.execute("SELECT COUNT(*) FROM films").fetchone()[0]
+    return {'hits': hits, 'misses': misses, 'entries': entries,
+            'film_hits': film_hits, 'film_misses': film_misses, 'films': films}
@@ -1,6 +1,8 @@
 # database.py
 
 import os
+import asyncio
+import contextvars
 import mysql.connector
 import log
 from dotenv import load_dotenv
@@ -10,38 +12,117 @@ db_address = os.getenv('DATABASE_ADDRESS')
 db_name = os.getenv('DATABASE_NAME')
 db_user = os.getenv('DATABASE_USER')
 db_pass = os.getenv('DATABASE_PASS')
+# most connections open at once, which is also the most queries that can run at the same time
+db_pool_size = int(os.getenv('DATABASE_POOL_SIZE', 5))
 
-mydb: mysql.connector.connection = None
+# connections that aren't checked out. A connection's only health check is the reconnect in Cursor.run when a
+# query on it fails, so checking one out or handing it back never costs a round trip
+idle: asyncio.Queue = None
+# connections opened so far, never more than db_pool_size
+opened = 0
+
+# the connection of the last cursor the current task checked out, which commit() applies to
+current_connection = contextvars.ContextVar('current_connection', default=None)
+
+
+class Cursor:
+    # a buffered cursor holding a pooled connection until it is closed.
+    # queries run on a worker thread, and buffering means reading the results afterwards never touches the network
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.cursor(buffered=True)
+
+    async def execute(self, operation, params=None):
+        await self.run('execute', operation, params)
+
+    async def executemany(self, operation, seq_params):
+        await self.run('executemany', operation, seq_params)
+
+    async def run(self, method: str, *args):
+        try:
+            await asyncio.to_thread(getattr(self.cursor, method), *args)
+        except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError):
+            # the connection timed out while sitting in the pool, so reconnect and try once more
+            await asyncio.to_thread(self.connection.reconnect, attempts=3, delay=1)
+            self.cursor = self.connection.cursor(buffered=True)
+            await asyncio.to_thread(getattr(self.cursor, method), *args)
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def close(self):
+        if self.connection is None:
+            return
+        self.cursor.close()
+        idle.put_nowait(self.connection)
+        if current_connection.get() is self.connection:
+            current_connection.set(None)
+        self.connection = None
+
+    def __del__(self):
+        # safety net so a forgotten close() can't leak a connection out of the pool
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def open_connection():
+    # autocommit, so a connection that only ran reads isn't left holding a transaction and an old snapshot
+    return mysql.connector.connect(host=str(db_address),
+                                   user=str(db_user),
+                                   password=str(db_pass),
+                                   database=str(db_name),
+                                   autocommit=True)
 
 
 async def connect():
-    global mydb
+    global idle
+    global opened
 
-    if mydb is None or not mydb.is_connected():
+    if idle is None:
+        idle = asyncio.Queue()
+        # open the first connection straight away so bad settings show up in the log at startup
+        opened += 1
         try:
-            mydb = mysql.connector.connect(
-                host=str(db_address),
-                user=str(db_user),
-                password=str(db_pass),
-                database=str(db_name)
-            )
+            idle.put_nowait(await asyncio.to_thread(open_connection))
         except Exception as e:
+            opened -= 1
             await log.error(e)
 
 
-async def get_cursor():
-    global mydb
+async def get_cursor() -> Cursor:
+    global opened
 
-    # connect to database in case of timeout on previous connection
     await connect()
 
-    return mydb.cursor(buffered=True)
+    if idle.empty() and opened < db_pool_size:
+        opened += 1
+        try:
+            connection = await asyncio.to_thread(open_connection)
+        except Exception:
+            opened -= 1
+            raise
+    else:
+        # every connection is checked out, so wait for one to be handed back
+        connection = await idle.get()
 
+    current_connection.set(connection)
+    return Cursor(connection)
 
-async def commit():
-    global mydb
 
-    # connect to database in case of timeout on previous connection
-    await connect()
-
-    mydb.commit()
+async def commit():
+    # statements commit on their own, this only matters if a transaction was started explicitly
+    connection = current_connection.get()
+    if connection is not None and connection.in_transaction:
+        await asyncio.to_thread(connection.commit)
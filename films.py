@@ -0,0 +1,42 @@
+# films.py
+
+import threading
+from array import array
+
+# every film the bot has seen gets one small integer id for the life of the process, with its title and slug
+# stored once here. Recommendations then hold plain arrays of ids instead of a (title, slug) tuple per list entry
+
+# interning happens on the scraping worker threads
+lock = threading.Lock()
+# film id: title / slug
+titles = []
+slugs = []
+# slug: film id
+ids = {}
+
+
+def intern(title: str, slug: str) -> int:
+    film_id = ids.get(slug)
+    if film_id is not None:
+        return film_id
+    with lock:
+        film_id = ids.get(slug)
+        if film_id is None:
+            film_id = len(slugs)
+            titles.append(title)
+            slugs.append(slug)
+            ids[slug] = film_id
+    return film_id
+
+
+def intern_list(films: list) -> array:
+    # a list of (title, slug) tuples as an array of film ids
+    return array('I', (intern(title, slug) for title, slug in films))
+
+
+def title(film_id: int) -> str:
+    return titles[film_id]
+
+
+def slug(film_id: int) -> str:
+    return slugs[film_id]
@@ -1,29 +1,98 @@
 # log.py
 
 import os
+import asyncio
 import discord
 from datetime import datetime
 from dotenv import load_dotenv
 
 load_dotenv('.env')
 LOG_CHANNEL = os.getenv('LOG_CHANNEL')
+# entries waiting to be sent before new ones only go to the log file
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 500))
+# seconds to wait after an entry arrives so a burst of entries can share one message
+LOG_BATCH_DELAY = float(os.getenv('LOG_BATCH_DELAY', 2))
+LOG_FILE = os.getenv('LOG_FILE', 'letterbot.log')
+
+# discord's limits for the embeds of a single message
+MAX_EMBEDS = 10
+MAX_EMBED_CHARACTERS = 6000
 
 global log_channel
 global client
 
+queue: asyncio.Queue = None
+sender: asyncio.Task = None
+dropped = 0
+
 
 async def initiate(bot_client: discord.Client):
     global log_channel
     global client
+    global queue
+    global sender
 
     client = bot_client
     log_channel = client.get_channel(int(LOG_CHANNEL))
 
+    if sender is None:
+        queue = asyncio.Queue(maxsize=LOG_QUEUE_SIZE)
+        sender = asyncio.create_task(send_batches())
+
 
 async def log(output: discord.Embed):
-    global log_channel
+    # only queues the entry, so logging never makes a command wait on discord
+    global dropped
     output.set_footer(text=datetime.now())
-    await log_channel.send(embed=output)
+
+    if queue is None:
+        write_file(output)
+        return
+    try:
+        queue.put_nowait(output)
+    except asyncio.QueueFull:
+        # the channel can't keep up, so the entry is kept in the file only
+        dropped += 1
+        write_file(output)
+
+
+async def send_batches():
+    while True:
+        batch = [await queue.get()]
+        await asyncio.sleep(LOG_BATCH_DELAY)
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+
+        # pack the entries into as few messages as the embed limits allow
+        message = []
+        characters = 0
+        for embed in batch:
+            if len(message) >= MAX_EMBEDS or characters + len(embed) > MAX_EMBED_CHARACTERS:
+                await send(message)
+                message = []
+                characters = 0
+            message.append(embed)
+            characters += len(embed)
+        await send(message)
+
+
+async def send(embeds: list):
+    if len(embeds) == 0:
+        return
+    try:
+        await log_channel.send(embeds=embeds)
+    except Exception as e:
+        print(f"\nERROR: could not send to the log channel: {e}")
+        for embed in embeds:
+            write_file(embed)
+
+
+def write_file(output: discord.Embed):
+    try:
+        with open(LOG_FILE, 'a', encoding='utf-8') as file:
+            file.write(f"{output.footer.text} {output.title}\n{output.description}\n\n")
+    except OSError as e:
+        print(f"\nERROR: could not write to {LOG_FILE}: {e}")
 
 
 async def slash(author: discord.Member, specific, guild: discord.Guild,
@@ -48,6 +117,18 @@ async def slash(author: discord.Member, specific, guild: discord.Guild,
     await log(embed)
 
 
+async def metrics(report: dict, guild: discord.Guild):
+    desc = "**Server:**\n"
+    desc += f"{guild.name} : {guild.id}\n"
+    desc += "**Metrics:**\n"
+    for item in report:
+        desc += f'{item}: {report[item]}\n'
+
+    print(f"\nmetrics for {guild}:{guild.id}: {report}")
+
+    await log(discord.Embed(title='METRICS', description=desc))
+
+
 async def error(error):
     embed = discord.Embed(title=f'ERROR', description=str(error), colour=15548997)
     print(f"\nERROR: {error}")
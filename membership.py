@@ -0,0 +1,58 @@
+# membership.py
+
+import os
+import asyncio
+from dotenv import load_dotenv
+import queries
+import log
+
+load_dotenv('.env')
+# seconds membership changes are collected for before they are written together
+DEBOUNCE = float(os.getenv('MEMBERSHIP_DEBOUNCE', 5))
+
+# (guild id, member id): True if the membership should exist, False if it should be removed.
+# only the latest change per membership is kept, so a quick leave and rejoin is a single write
+pending = {}
+flush_task: asyncio.Task = None
+
+
+def add(guild_id: int, member_id: int):
+    pending[(guild_id, member_id)] = True
+    schedule()
+
+
+def remove(guild_id: int, member_id: int):
+    pending[(guild_id, member_id)] = False
+    schedule()
+
+
+def schedule():
+    global flush_task
+
+    if flush_task is None or flush_task.done():
+        flush_task = asyncio.create_task(flush_later())
+
+
+async def flush_later():
+    # changes that arrive while a flush is writing find this task still running, so keep going until none are left
+    while len(pending) > 0:
+        await asyncio.sleep(DEBOUNCE)
+        try:
+            await flush()
+        except Exception as e:
+            await log.error(e)
+
+
+async def flush():
+    global pending
+
+    changes = pending
+    pending = {}
+
+    additions = [key for key, value in changes.items() if value]
+    removals = [key for key, value in changes.items() if not value]
+
+    # memberships are only kept for members with a linked account
+    linked = set(await queries.linked_members(list(set(member for guild, member in additions))))
+    await queries.add_memberships([(guild, member) for guild, member in additions if str(member) in linked])
+    await queries.remove_memberships(removals)
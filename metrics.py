@@ -0,0 +1,129 @@
+# metrics.py
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv('.env')
+# if set, the Prometheus text export is written here after every recommendation, for a textfile collector
+METRICS_FILE = os.getenv('METRICS_FILE')
+
+# process-wide totals, shared by the scraping worker threads
+lock = threading.Lock()
+totals = {'recommendations': 0,
+          'http_requests': 0}
+# phase: [total seconds, times run]
+phase_totals = {}
+# values that go up and down, like how many recommendations are open
+gauges = {}
+
+
+def count(name: str, amount=1):
+    with lock:
+        totals[name] = totals.get(name, 0) + amount
+
+
+def count_request():
+    count('http_requests')
+
+
+def set_gauge(name: str, value):
+    with lock:
+        gauges[name] = value
+
+
+class RunMetrics:
+    # timings and counts for a single recommendation.
+    # request and cache counts are the change in the process-wide totals while the run was going,
+    # so recommendations running at the same time will see some of each other's requests
+    def __init__(self):
+        self.started = time.perf_counter()
+        # phase: seconds
+        self.spans = {}
+        # letterboxd username: seconds to collect all of their lists
+        self.user_durations = {}
+        self.values = {}
+        self.start_totals = None
+        self.finished = False
+
+    def begin(self, cache_stats: dict):
+        # time spent waiting on manual attendance isn't part of the run
+        self.started = time.perf_counter()
+        with lock:
+            self.start_totals = dict(totals)
+        self.start_totals.update({f"cache_{key}": value for key, value in cache_stats.items()})
+
+    @contextmanager
+    def span(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[phase] = self.spans.get(phase, 0) + time.perf_counter() - start
+
+    def set(self, name: str, value):
+        self.values[name] = value
+
+    def finish(self, cache_stats: dict) -> dict:
+        self.finished = True
+        with lock:
+            end_totals = dict(totals)
+            totals['recommendations'] += 1
+            for phase, seconds in self.spans.items():
+                phase_total = phase_totals.setdefault(phase, [0.0, 0])
+                phase_total[0] += seconds
+                phase_total[1] += 1
+        end_totals.update({f"cache_{key}": value for key, value in cache_stats.items()})
+
+        report = {'total_seconds': round(time.perf_counter() - self.started, 3),
+                  'phases': {phase: round(seconds, 3) for phase, seconds in self.spans.items()},
+                  'slowest_users': dict(sorted(((user, round(seconds, 3))
+                                                for user, seconds in self.user_durations.items()),
+                                               key=lambda x: x[1], reverse=True)[:5])}
+        report.update(self.values)
+        for name in ('http_requests', 'cache_hits', 'cache_misses', 'cache_film_hits', 'cache_film_misses'):
+            report[name] = end_totals.get(name, 0) - (self.start_totals or {}).get(name, 0)
+
+        if METRICS_FILE:
+            write_file()
+        return report
+
+
+def export_json() -> str:
+    with lock:
+        return json.dumps({'totals': totals,
+                           'gauges': gauges,
+                           'phases': {phase: {'seconds': value[0], 'runs': value[1]}
+                                      for phase, value in phase_totals.items()}})
+
+
+def export_prometheus() -> str:
+    lines = []
+    with lock:
+        lines.append("# TYPE letterbot_recommendations_total counter")
+        lines.append(f"letterbot_recommendations_total {totals['recommendations']}")
+        lines.append("# TYPE letterbot_http_requests_total counter")
+        lines.append(f"letterbot_http_requests_total {totals['http_requests']}")
+        lines.append("# TYPE letterbot_phase_seconds_total counter")
+        for phase, value in phase_totals.items():
+            lines.append(f'letterbot_phase_seconds_total{{phase="{phase}"}} {value[0]:.6f}')
+        lines.append("# TYPE letterbot_phase_runs_total counter")
+        for phase, value in phase_totals.items():
+            lines.append(f'letterbot_phase_runs_total{{phase="{phase}"}} {value[1]}')
+        for name, value in gauges.items():
+            lines.append(f"# TYPE letterbot_{name} gauge")
+            lines.append(f"letterbot_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_file():
+    try:
+        # written to a temporary file first so a collector never reads half of it
+        with open(f"{METRICS_FILE}.tmp", 'w') as file:
+            file.write(export_prometheus())
+        os.replace(f"{METRICS_FILE}.tmp", METRICS_FILE)
+    except OSError as e:
+        print(f"\nERROR: could not write metrics to {METRICS_FILE}: {e}")
@@ -0,0 +1,81 @@
+# prewarm.py
+
+import os
+import time
+import asyncio
+from dotenv import load_dotenv
+import queries
+import cache
+import scraper
+import recommend
+import scheduler
+import log
+
+load_dotenv('.env')
+# minutes between background refreshes
+INTERVAL = float(os.getenv('PREWARM_INTERVAL', 60))
+# guilds that haven't asked for a recommendation in this many days aren't kept warm
+MAX_IDLE = float(os.getenv('PREWARM_MAX_IDLE_DAYS', 14)) * 24 * 60 * 60
+# seconds to wait between background scrapes, to stay polite to letterboxd.com
+DELAY = float(os.getenv('PREWARM_DELAY', 2))
+# how many of the most watchlisted films get their ratings and runtimes kept warm
+FILM_COUNT = int(os.getenv('PREWARM_FILMS', 200))
+
+
+async def mark_used(guild_id):
+    await asyncio.to_thread(cache.mark_guild_used, guild_id)
+
+
+async def wait_for_turn():
+    await asyncio.sleep(DELAY)
+    # recommendations that are running get letterboxd.com to themselves
+    while recommend.active_collections > 0:
+        await asyncio.sleep(5)
+
+
+async def refresh():
+    # anything a recommendation asks for goes first
+    scheduler.priority.set(scheduler.BACKGROUND)
+    guilds = await asyncio.to_thread(cache.recent_guilds, time.time() - MAX_IDLE)
+
+    # accounts of the most recently active guilds come first
+    accounts = []
+    for guild in guilds:
+        for item in await queries.guild_accounts(guild):
+            if str(item[1]) not in accounts:
+                accounts.append(str(item[1]))
+
+    # refresh every list that would expire before the next refresh
+    stale_after = cache.PROFILE_TTL - INTERVAL * 60
+    watchlists = []
+    for account in accounts:
+        for list_type in scraper.LIST_PATHS:
+            snapshot = await asyncio.to_thread(cache.get_snapshot, account, list_type)
+            films = None if snapshot is None else snapshot['films']
+            if snapshot is None or time.time() - snapshot['fetched_at'] > stale_after:
+                await wait_for_turn()
+                try:
+                    films = await asyncio.to_thread(scraper.refresh_list, account, list_type)
+                except Exception as e:
+                    await log.error(f"Background refresh of {account}'s {list_type} failed: {e}")
+            if list_type == 'watchlist' and films is not None:
+                watchlists.append(films)
+
+    # the films on the most watchlists are the most likely to be recommended
+    counts = {}
+    titles = {}
+    for watchlist in watchlists:
+        for film in watchlist:
+            counts[film[1]] = counts.get(film[1], 0) + 1
+            titles[film[1]] = film[0]
+    popular = sorted(counts, key=counts.get, reverse=True)[:FILM_COUNT]
+
+    stored = await asyncio.to_thread(cache.get_films, popular)
+    for slug in popular:
+        if slug in stored:
+            continue
+        await wait_for_turn()
+        try:
+            await asyncio.to_thread(scraper.load_film, slug, titles[slug])
+        except Exception as e:
+            await log.error(f"Background refresh of {slug} failed: {e}")
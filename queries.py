@@ -0,0 +1,144 @@
+# queries.py
+
+import database
+
+# every statement the bot runs, with %s placeholders so values are sent as parameters instead of being
+# formatted into the SQL text
+SELECT_GUILDS = "SELECT guild, test FROM guilds"
+SELECT_GUILD = "SELECT guild, test FROM guilds WHERE guild=%s"
+INSERT_GUILD = "INSERT INTO guilds (guild, test) VALUES (%s, b'0')"
+SELECT_USER_BY_MEMBER = "SELECT member, account FROM users WHERE member=%s"
+SELECT_USER_BY_ACCOUNT = "SELECT member, account FROM users WHERE account=%s"
+REPLACE_USER = "REPLACE INTO users (member, account) VALUES (%s, %s)"
+DELETE_USER = "DELETE FROM users WHERE member=%s"
+SELECT_GUILD_ACCOUNTS = ("SELECT users.member, users.account FROM users, memberships "
+                         "WHERE memberships.guild=%s AND users.member=memberships.member "
+                         "ORDER BY account")
+# executemany turns an INSERT into one multi-row statement, which it won't do for REPLACE
+INSERT_MEMBERSHIP = ("INSERT INTO memberships (guild, member) VALUES (%s, %s) "
+                     "ON DUPLICATE KEY UPDATE member=VALUES(member)")
+DELETE_MEMBERSHIP = "DELETE FROM memberships WHERE guild=%s AND member=%s"
+DELETE_GUILD_MEMBERSHIPS = "DELETE FROM memberships WHERE guild=%s"
+SELECT_GUILD_MEMBERSHIPS = "SELECT member FROM memberships WHERE guild=%s"
+
+# (table, index name, columns) that the lookups above rely on
+INDEXES = (('users', 'users_member', ('member',)),
+           ('users', 'users_account', ('account',)),
+           ('memberships', 'memberships_guild_member', ('guild', 'member')))
+
+# most values put in one IN (...) list
+IN_CHUNK = 1000
+
+
+async def fetch(statement: str, params=()) -> list:
+    cursor = await database.get_cursor()
+    try:
+        await cursor.execute(statement, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+async def write(statement: str, params=()):
+    cursor = await database.get_cursor()
+    try:
+        await cursor.execute(statement, params)
+        await database.commit()
+    finally:
+        cursor.close()
+
+
+async def write_many(statement: str, seq_params: list):
+    if len(seq_params) == 0:
+        return
+    cursor = await database.get_cursor()
+    try:
+        await cursor.executemany(statement, seq_params)
+        await database.commit()
+    finally:
+        cursor.close()
+
+
+async def ensure_indexes():
+    # mysql has no CREATE INDEX IF NOT EXISTS, so look for an index that already starts with the same columns
+    for table, name, columns in INDEXES:
+        rows = await fetch("SELECT index_name, seq_in_index, column_name FROM information_schema.statistics "
+                           "WHERE table_schema=DATABASE() AND table_name=%s", (table,))
+        existing = {}
+        for row in rows:
+            existing.setdefault(row[0], {})[int(row[1])] = row[2]
+        prefixes = [tuple(index.get(i + 1) for i in range(len(columns))) for index in existing.values()]
+        if columns not in prefixes:
+            await write(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+
+
+async def guilds() -> dict:
+    # guild id: whether it is a test guild
+    return {int(row[0]): row[1] == 1 for row in await fetch(SELECT_GUILDS)}
+
+
+async def guild_test(guild_id):
+    # whether the guild is a test guild, or None if it isn't registered
+    for row in await fetch(SELECT_GUILD, (str(guild_id),)):
+        return row[1] == 1
+    return None
+
+
+async def add_guild(guild_id):
+    await write(INSERT_GUILD, (str(guild_id),))
+
+
+async def linked_members(member_ids: list) -> list:
+    # the members out of member_ids that have a linked account
+    linked = []
+    for i in range(0, len(member_ids), IN_CHUNK):
+        chunk = [str(member_id) for member_id in member_ids[i:i + IN_CHUNK]]
+        rows = await fetch(f"SELECT member FROM users WHERE member IN ({', '.join(['%s'] * len(chunk))})", chunk)
+        linked += [str(row[0]) for row in rows]
+    return linked
+
+
+async def add_memberships(memberships: list):
+    # memberships is a list of (guild id, member id), all written in one round trip
+    await write_many(INSERT_MEMBERSHIP, [(str(guild), str(member)) for guild, member in memberships])
+
+
+async def remove_memberships(memberships: list):
+    # memberships is a list of (guild id, member id)
+    await write_many(DELETE_MEMBERSHIP, [(str(guild), str(member)) for guild, member in memberships])
+
+
+async def guild_memberships(guild_id) -> list:
+    # member ids with a membership in the guild, as strings
+    return [str(row[0]) for row in await fetch(SELECT_GUILD_MEMBERSHIPS, (str(guild_id),))]
+
+
+async def remove_guild_memberships(guild_id):
+    await write(DELETE_GUILD_MEMBERSHIPS, (str(guild_id),))
+
+
+async def user_by_member(member_id):
+    # (member, account) or None
+    for row in await fetch(SELECT_USER_BY_MEMBER, (str(member_id),)):
+        return row
+    return None
+
+
+async def user_by_account(account: str):
+    # (member, account) or None
+    for row in await fetch(SELECT_USER_BY_ACCOUNT, (account,)):
+        return row
+    return None
+
+
+async def link_user(member_id, account: str):
+    await write(REPLACE_USER, (str(member_id), account))
+
+
+async def unlink_user(member_id):
+    await write(DELETE_USER, (str(member_id),))
+
+
+async def guild_accounts(guild_id) -> list:
+    # (member, account) of every linked member of the guild, ordered by account
+    return await fetch(SELECT_GUILD_ACCOUNTS, (str(guild_id),))
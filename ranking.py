@@ -0,0 +1,116 @@
+# ranking.py
+
+import bisect
+from array import array
+
+# stored runtime of films without one
+NO_RUNTIME = -1
+# passed to update() for values that stay as they are, since None is a valid runtime
+UNCHANGED = object()
+
+
+class Ranking:
+    # films ordered by score then rating, both highest first.
+    # films are kept in one bucket per score, each bucket sorted by rating, so a page can be sliced by skipping
+    # whole buckets instead of sorting and walking every film.
+    # film data is kept as parallel arrays indexed by a slot per film rather than a tuple per film
+    def __init__(self):
+        # film id: slot
+        self.slots = {}
+        self.film_scores = array('i')
+        self.film_ratings = array('d')
+        self.film_runtimes = array('i')
+        # slots of removed films, reused by the next added film
+        self.free_slots = []
+        # score: sorted list of (-rating, film id)
+        self.buckets = {}
+        # distinct scores, lowest first
+        self.scores = []
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, film):
+        return film in self.slots
+
+    def __getitem__(self, film):
+        # (score, rating, runtime)
+        slot = self.slots[film]
+        runtime = self.film_runtimes[slot]
+        return self.film_scores[slot], self.film_ratings[slot], None if runtime == NO_RUNTIME else runtime
+
+    def items(self):
+        return ((film, self[film]) for film in self.slots)
+
+    def add(self, film, score: int, rating: float = 0.0, runtime=None):
+        if film in self.slots:
+            self.remove(film)
+
+        if len(self.free_slots) > 0:
+            slot = self.free_slots.pop()
+            self.film_scores[slot] = score
+            self.film_ratings[slot] = rating
+            self.film_runtimes[slot] = NO_RUNTIME if runtime is None else runtime
+        else:
+            slot = len(self.film_scores)
+            self.film_scores.append(score)
+            self.film_ratings.append(rating)
+            self.film_runtimes.append(NO_RUNTIME if runtime is None else runtime)
+        self.slots[film] = slot
+
+        if score not in self.buckets:
+            self.buckets[score] = []
+            bisect.insort(self.scores, score)
+        bisect.insort(self.buckets[score], (-rating, film))
+
+    def update(self, film, score=UNCHANGED, rating=UNCHANGED, runtime=UNCHANGED):
+        old = self[film]
+        self.add(film,
+                 old[0] if score is UNCHANGED else score,
+                 old[1] if rating is UNCHANGED else rating,
+                 old[2] if runtime is UNCHANGED else runtime)
+
+    def remove(self, film):
+        slot = self.slots.pop(film)
+        score = self.film_scores[slot]
+        rating = self.film_ratings[slot]
+        self.free_slots.append(slot)
+
+        bucket = self.buckets[score]
+        del bucket[bisect.bisect_left(bucket, (-rating, film))]
+        if len(bucket) == 0:
+            del self.buckets[score]
+            del self.scores[bisect.bisect_left(self.scores, score)]
+
+    def groups(self, end: int):
+        # the score buckets holding the first `end` films, highest score first, as (score, [films])
+        groups = []
+        count = 0
+        for score in reversed(self.scores):
+            if count >= end:
+                break
+            groups.append((score, [entry[1] for entry in self.buckets[score]]))
+            count += len(self.buckets[score])
+        return groups
+
+    def page(self, start: int, count: int):
+        # (film, (score, rating, runtime)) for the films ranked start to start + count
+        page = []
+        for score in reversed(self.scores):
+            bucket = self.buckets[score]
+            if start >= len(bucket):
+                start -= len(bucket)
+                continue
+            for entry in bucket[start:start + count - len(page)]:
+                page.append((entry[1], self[entry[1]]))
+            start = 0
+            if len(page) >= count:
+                break
+        return page
+
+    def memory_footprint(self):
+        # a rough estimate in bytes
+        size = self.slots.__sizeof__() + self.film_scores.__sizeof__()
+        size += self.film_ratings.__sizeof__() + self.film_runtimes.__sizeof__()
+        size += sum(bucket.__sizeof__() for bucket in self.buckets.values())
+        return size
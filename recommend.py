@@ -1,27 +1,73 @@
 # recommend.py
+import os
+import sys
 import math
+import time
+import asyncio
 
 import discord
 from discord.ext import commands
-import database
-from letterboxdpy import user as lb_user
-from letterboxdpy import movie as lb_movie
+from dotenv import load_dotenv
+import queries
+import scraper
+import cache
+import films
+import log
+import metrics
+import scheduler
+import sessions
+from ranking import Ranking
+from scoring import ScoringMatrix, LIST_COLUMNS
+
+load_dotenv('.env')
+# how many Letterboxd list scrapes may run at the same time across all users of a recommendation
+SCRAPE_CONCURRENCY = int(os.getenv('SCRAPE_CONCURRENCY', 6))
+# seconds a single list scrape may take before it stops and is abandoned
+SCRAPE_TIMEOUT = float(os.getenv('SCRAPE_TIMEOUT', 180))
+# how many films may have their ratings and runtimes fetched at the same time
+METADATA_CONCURRENCY = int(os.getenv('METADATA_CONCURRENCY', 8))
+# films past the end of the requested page that get resolved ahead of time
+PREFETCH_MARGIN = int(os.getenv('PREFETCH_MARGIN', 10))
+# least seconds between two edits of a recommendation's message
+UPDATE_INTERVAL = float(os.getenv('EMBED_UPDATE_INTERVAL', 1))
+# pages after the one being looked at that are rendered in the background
+PREFETCH_PAGES = int(os.getenv('PREFETCH_PAGES', 3))
+
+# largest score a scoring rule can give, so a film's total always fits the 32 bit integers scores are kept in
+MAX_RULE_SCORE = 1000
+
+# RecommendationUser list: the Letterboxd list it is scraped from
+LIST_TYPES = {'watchlist': 'watchlist',
+              'watched_movies': 'watched',
+              'liked_movies': 'liked'}
+
+# recommendations currently collecting or scoring movies, which background work yields to
+active_collections = 0
 
 
 class RecommendationUser:
-    def __init__(self, account: lb_user.User, user: discord.User):
-        self.account = account
+    # there is one of these per linked member per recommendation, so no per-instance __dict__
+    __slots__ = ('username', 'user', 'attendance_value', 'watchlist', 'watched_movies', 'liked_movies',
+                 'display_string')
+
+    def __init__(self, username: str, user: discord.User):
+        self.username = username
         self.user = user
 
         self.attendance_value = None
-        self.watchlist = []
-        self.watched_movies = []
-        self.liked_movies = []
+        # arrays of film ids, see films.py
+        self.watchlist = films.intern_list([])
+        self.watched_movies = films.intern_list([])
+        self.liked_movies = films.intern_list([])
+
+        self.display_string = None
 
     async def display_user(self):
-        mention = self.user.mention
-        username = self.account.username
-        return f"{mention} - [{username}](https://letterboxd.com/{username}/)"
+        if self.display_string is None:
+            mention = self.user.mention
+            username = self.username
+            self.display_string = f"{mention} - [{username}](https://letterboxd.com/{username}/)"
+        return self.display_string
 
 
 class ScoringRules:
@@ -38,7 +84,7 @@ class ScoringRules:
         self.watched_present = present_scores[1]
         self.liked_present = present_scores[2]
 
-        self.watched_absent = absent_scores[0]
+        self.watchlist_absent = absent_scores[0]
         self.watched_absent = absent_scores[1]
         self.liked_absent = absent_scores[2]
 
@@ -52,6 +98,9 @@ class Recommendation:
     def __init__(self, channel_for_attendance: discord.VoiceChannel):
         # slash command Interaction object
         self.initiator: discord.Interaction = None
+        # the message the recommendation is shown in. Its interaction token expires after 15 minutes,
+        # so edits go through the message itself, which the bot can edit for as long as it exists
+        self.message: discord.Message = None
 
         # progression states
         self.taking_attendance = False
@@ -73,7 +122,10 @@ class Recommendation:
         self.present_users = []
         self.ignored_users = []
         self.absent_users = []
-        self.movies = {}
+        self.movies = Ranking()
+        self.scoring_matrix: ScoringMatrix = None
+        # columns of the scoring matrix whose lists have been collected
+        self.collected_columns = set()
 
         # parameters
         self.attendance_channel = channel_for_attendance
@@ -85,20 +137,69 @@ class Recommendation:
         self.current_page = 0
         self.total_pages = 0
         self.loading_recalculation = False
+        self.metrics = metrics.RunMetrics()
+
+        # message updates
+        self.update_pending = False
+        self.update_task: asyncio.Task = None
+        self.last_update = 0.0
+        self.last_rendered = None
+        # attendance column name: (users in the column, rendered column)
+        self.attendance_strings = {}
+
+        # page number: task rendering that page's embed fields and poster
+        self.pages = {}
+        self.prefetch_task: asyncio.Task = None
+
+        self.guild_id = None
+        self.closed = False
 
     async def initiate(self, initiator: discord.Interaction):
         self.initiator = initiator
+        self.guild_id = initiator.guild_id
 
         # views are created down here so that they can get reference to this initiator during their __init__
         self.view_attendance = AttendanceView(self)
         self.view_final = FinalView(self)
 
         await initiator.response.send_message(embeds=await self.make_embeds())
+        self.message = await initiator.original_response()
         await self.find_accounts()
 
     async def update_response(self):
-        await self.initiator.edit_original_response(embeds=await self.make_embeds(),
-                                                    view=self.get_view())
+        # only marks the message as out of date. A single task edits it with whatever the latest state is,
+        # at most once every UPDATE_INTERVAL, so bursts of progress updates become one edit
+        self.update_pending = True
+        if self.update_task is None or self.update_task.done():
+            self.update_task = asyncio.create_task(self.flush_updates())
+
+    async def flush_updates(self):
+        while self.update_pending:
+            wait = self.last_update + UPDATE_INTERVAL - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.update_pending = False
+
+            try:
+                embeds = await self.make_embeds()
+            except Exception as e:
+                # nothing awaits this task, so a recommendation that can't be shown is closed here
+                await log.error(e)
+                await self.close()
+                return
+            view = self.get_view()
+            rendered = ([embed.to_dict() for embed in embeds], id(view),
+                        None if view is None else [(item.label, item.disabled) for item in view.children])
+            # nothing visible changed since the last edit
+            if rendered == self.last_rendered:
+                continue
+
+            self.last_rendered = rendered
+            self.last_update = time.monotonic()
+            try:
+                await self.message.edit(embeds=embeds, view=view)
+            except Exception as e:
+                await log.error(e)
 
     async def make_embeds(self):
         embeds = []
@@ -133,31 +234,36 @@ class Recommendation:
 
         if self.taking_attendance or self.attendance_done:
             description = None
-            if not self.attendance_done:
+            if not self.attendance_done and self.active_account_index < len(self.users):
                 active_user = self.users[self.active_account_index]
                 description = (await active_user.display_user())
             attendance_embed = discord.Embed(title="**ATTENDANCE**",
                                              description=description)
-            users_string = ""
-            for user in self.present_users:
-                users_string += f"{await user.display_user()}\n"
-            attendance_embed.add_field(name="**PRESENT**", value=users_string)
-
-            users_string = ""
-            for user in self.ignored_users:
-                users_string += f"{await user.display_user()}\n"
-            attendance_embed.add_field(name="**IGNORED**", value=users_string)
-
-            users_string = ""
-            for user in self.absent_users:
-                users_string += f"{await user.display_user()}\n"
-            attendance_embed.add_field(name="**ABSENT**", value=users_string)
+            attendance_embed.add_field(name="**PRESENT**", value=await self.attendance_string("PRESENT",
+                                                                                          self.present_users))
+            attendance_embed.add_field(name="**IGNORED**", value=await self.attendance_string("IGNORED",
+                                                                                          self.ignored_users))
+            attendance_embed.add_field(name="**ABSENT**", value=await self.attendance_string("ABSENT",
+                                                                                         self.absent_users))
 
             embeds.append(attendance_embed)
 
         return embeds
 
+    async def attendance_string(self, name: str, users: list):
+        # users are only ever added to the attendance lists, so a column only needs rendering when it grows
+        if name in self.attendance_strings and self.attendance_strings[name][0] == len(users):
+            return self.attendance_strings[name][1]
+
+        users_string = ""
+        for user in users:
+            users_string += f"{await user.display_user()}\n"
+        self.attendance_strings[name] = (len(users), users_string)
+        return users_string
+
     def get_view(self):
+        if self.closed:
+            return None
         if self.taking_attendance:
             return self.view_attendance
         if self.recommendations_done:
@@ -165,18 +271,19 @@ class Recommendation:
         return None
 
     async def find_accounts(self):
-        cursor = await database.get_cursor()
-        cursor.execute(f"SELECT users.member, users.account FROM users, memberships WHERE "
-                       f"memberships.member=users.member AND memberships.guild='{self.initiator.guild_id}'")
+        with self.metrics.span('find_accounts'):
+            linked = await queries.guild_accounts(self.initiator.guild_id)
 
         self.embed_desc_gathering += f"\nFinding linked Letterboxd accounts..."
         await self.update_response()
 
-        for item in cursor:
-            self.users.append(RecommendationUser(lb_user.User(str(item[1])),
-                                                 self.initiator.client.get_user(int(item[0]))))
+        for item in linked:
+            self.users.append(RecommendationUser(str(item[1]), self.initiator.client.get_user(int(item[0]))))
 
-        cursor.close()
+        if len(self.users) == 0:
+            self.embed_desc_gathering += f"\nCannot recommend anything since there are no linked members"
+            await self.close()
+            return
 
         # if attendance should be automatic
         if self.attendance_channel is not None:
@@ -196,145 +303,335 @@ class Recommendation:
             self.embed_desc_gathering += f"\nPlease manually take attendance..."
             await self.update_response()
 
+    def plan_lists(self, rules: tuple) -> dict:
+        # column of the scoring matrix: the users whose list for it has to be collected.
+        # ignored users are never scored and a list worth 0 points can't change a score, so neither is scraped.
+        # the present users' watchlists are always needed, they are the films that can be recommended
+        users = {'present': self.present_users, 'absent': self.absent_users}
+        plan = {}
+        for column, (attendance, list_name) in enumerate(LIST_COLUMNS):
+            if column not in self.collected_columns and (column == 0 or rules[column] != 0):
+                plan[column] = users[attendance]
+        return plan
+
     async def collect_movies(self):
-        self.embed_desc_gathering += f"\nCollecting movies in watchlists..."
+        self.embed_desc_gathering += f"\nCollecting watchlists, watched movies and liked movies..."
         await self.update_response()
-        for user in self.users:
-            user.watchlist = lb_user.user_films_on_watchlist(user.account)
 
-        self.embed_desc_gathering += f"\nCollecting movies that have already been seen..."
-        await self.update_response()
-        for user in self.users:
-            user.watched_movies = lb_user.user_films_watched(user.account)
+        self.metrics.begin(await asyncio.to_thread(cache.stats))
+        plan = self.plan_lists(self.scoring_rules.get_rules())
+        self.metrics.set('lists_skipped', len(self.users) * 3 - sum(len(users) for users in plan.values()))
 
-        self.embed_desc_gathering += f"\nCollecting movies that have been liked..."
-        await self.update_response()
-        for user in self.users:
-            user.liked_movies = lb_user.user_films_liked(user.account)
+        with self.metrics.span('collect'):
+            await self.collect_lists(plan, progress=True)
 
         await self.apply_scoring()
 
+    async def collect_lists(self, plan: dict, progress=False):
+        # scrapes every list in the plan into the users' RecommendationUser lists
+        semaphore = asyncio.Semaphore(SCRAPE_CONCURRENCY)
+        finished = 0
+        users = [user for user in self.users if any(user in column_users for column_users in plan.values())]
+
+        # absent users' watched films only matter if they can be recommended, so those lists wait for the films
+        # that can be, to see whether checking those films one by one is cheaper than scraping the whole history
+        candidates = asyncio.get_running_loop().create_future()
+        watchlists_left = len(plan.get(0, []))
+        if self.scoring_matrix is not None:
+            candidates.set_result(film_tuples(self.scoring_matrix.films.tolist()))
+        elif watchlists_left == 0:
+            candidates.set_result([])
+
+        async def fetch(column, user: RecommendationUser):
+            nonlocal watchlists_left
+            attendance, list_name = LIST_COLUMNS[column]
+            if attendance == 'absent' and list_name == 'watched_movies':
+                among = await candidates
+                async with semaphore:
+                    return await asyncio.to_thread(load_watched_ids, user.username, among,
+                                                   time.monotonic() + SCRAPE_TIMEOUT)
+
+            # the scrapers are blocking, so they are sent to worker threads to keep the event loop free.
+            # a thread can't be cancelled, so a scrape is given its deadline and stops itself between requests,
+            # and only lets go of the semaphore once it really has stopped
+            try:
+                async with semaphore:
+                    film_ids = await asyncio.to_thread(load_film_ids, user.username, LIST_TYPES[list_name],
+                                                       time.monotonic() + SCRAPE_TIMEOUT)
+                if column == 0:
+                    user.watchlist = film_ids
+                return film_ids
+            finally:
+                if column == 0:
+                    watchlists_left -= 1
+                    if watchlists_left == 0:
+                        candidates.set_result(film_tuples(set().union(*(other.watchlist for other in plan[0]))))
+
+        async def collect_user(user: RecommendationUser):
+            nonlocal finished
+            start = time.perf_counter()
+            columns = [column for column in plan if user in plan[column]]
+            results = await asyncio.gather(*(fetch(column, user) for column in columns), return_exceptions=True)
+
+            # a failed or timed out list is treated as empty so one bad profile can't stop the recommendation
+            failed = False
+            for column, result in zip(columns, results):
+                if isinstance(result, BaseException):
+                    failed = True
+                    if isinstance(result, (asyncio.TimeoutError, TimeoutError)):
+                        await log.error(f"Timed out collecting movies for {user.username}")
+                    else:
+                        await log.error(result)
+                    result = films.intern_list([])
+                setattr(user, LIST_COLUMNS[column][1], result)
+            self.metrics.user_durations[user.username] = time.perf_counter() - start
+
+            finished += 1
+            if progress:
+                status = "failed to collect some movies for" if failed else "collected movies for"
+                self.embed_desc_gathering += f"\n- {status} {user.username} ({finished}/{len(users)})"
+                await self.update_response()
+
+        await asyncio.gather(*(collect_user(user) for user in users))
+        self.collected_columns.update(plan)
+
     async def apply_scoring(self):
         self.embed_desc_gathering += f"\nApplying the scoring rules to the movies eligible for recommendation..."
         await self.update_response()
 
-        def add_score(value: int, film, add_movie=False):
-            if film in self.movies:
-                self.movies[film] = (self.movies[film][0] + value, 0.0, 0)
-            elif add_movie:
-                self.movies[film] = (value, 0.0, 0)
-
-        score_rules = ScoringRules.get_rules(self.scoring_rules)
-
-        # populate list with watchlisted movies
-        for user in self.present_users:
-            for movie in user.watchlist:
-                add_score(score_rules[0], movie, True)
-
-        # apply scoring for present users
-        for user in self.present_users:
-            for movie in user.watched_movies:
-                add_score(score_rules[1], movie)
-            for movie in user.liked_movies:
-                add_score(score_rules[2], movie)
-
-        # apply scoring for absent users
-        for user in self.absent_users:
-            for movie in user.watchlist:
-                add_score(score_rules[3], movie)
-            for movie in user.watched_movies:
-                add_score(score_rules[4], movie)
-            for movie in user.liked_movies:
-                add_score(score_rules[5], movie)
+        with self.metrics.span('scoring'):
+            self.scoring_matrix = ScoringMatrix(self.present_users, self.absent_users)
+
+            self.movies = Ranking()
+            for movie, score in self.scoring_matrix.scored_films(self.scoring_rules.get_rules()):
+                self.movies.add(movie, score)
+        self.metrics.set('candidates', len(self.scoring_matrix))
+
+        # the matrix holds everything scoring needs from here on, so the scraped lists can be let go
+        self.free_lists()
+
+        # fill in every film that already has fresh data in the film store with one lookup
+        with self.metrics.span('film_store'):
+            unresolved = {films.slug(movie): movie for movie in self.movies.slots}
+            stored = await asyncio.to_thread(cache.get_films, list(unresolved))
+            for slug, movie_data in stored.items():
+                self.set_movie_data(unresolved[slug], movie_data)
 
         await self.calculate_recommendation()
 
     async def calculate_recommendation(self):
-        self.embed_desc_gathering += f"\nCalculating recommendations..."
+        if not self.recommendations_done:
+            self.embed_desc_gathering += f"\nCalculating recommendations..."
+        # only show the loading footer if the page wasn't rendered ahead of time
+        page_number = self.current_page
+        self.loading_recalculation = self.recommendations_done and not self.page_ready(page_number)
         await self.update_response()
 
-        async def find_data_for_score(my_score):
-            for my_movie in list(self.movies):
-                if self.movies[my_movie][0] == my_score:
-                    await find_movie_data(my_movie)
+        page = self.get_page(page_number)
+        try:
+            fields, poster_link = await page
+        except Exception:
+            # don't keep a failed render around, so the next press tries again
+            if self.pages.get(page_number) is page:
+                self.pages.pop(page_number, None)
+            raise
+
+        # another press or a rescore moved on while this page rendered, and whichever call did that shows its own
+        # page. An older slow render finishing late must not replace it
+        if page_number != self.current_page or self.pages.get(page_number) is not page:
+            return
+        self.embed_fields_recommendation, self.poster_link = fields, poster_link
 
-        async def find_movie_data(my_movie):
-            movie_data = lb_movie.Movie(my_movie[1])
-            my_rating = movie_data.rating.split()[0]
-            my_runtime = movie_data.runtime
+        self.total_pages = int(math.ceil(len(self.movies) / self.limit_per_page))
+
+        self.recommendations_done = True
+        self.loading_recalculation = False
+        await self.update_response()
 
-            # protection for if the movie has no rating
+        # the run is measured up to its first page, later page turns only add to the process totals
+        if not self.metrics.finished:
+            report = self.metrics.finish(await asyncio.to_thread(cache.stats))
+            sessions.update_gauges()
+            report.update({f"live_{name}": value for name, value in sessions.stats().items()})
+            await log.metrics(report, self.initiator.guild)
+
+        if self.prefetch_task is None or self.prefetch_task.done():
+            self.prefetch_task = asyncio.create_task(self.prefetch_pages(page_number))
+
+    def page_ready(self, page_number: int):
+        return page_number in self.pages and self.pages[page_number].done()
+
+    def get_page(self, page_number: int) -> asyncio.Task:
+        # a page is rendered once and shared by everything that asks for it, including renders still running
+        if page_number not in self.pages:
+            self.pages[page_number] = asyncio.create_task(self.render_page(page_number))
+        return self.pages[page_number]
+
+    async def prefetch_pages(self, page_number: int):
+        # render the next few pages in order in the background, so the next button is answered straight away
+        for next_page in range(page_number + 1, page_number + 1 + PREFETCH_PAGES):
+            if next_page * self.limit_per_page >= len(self.movies):
+                return
             try:
-                my_rating = float(my_rating)
-            except:
-                my_rating = float(0)
+                await self.get_page(next_page)
+            except Exception as e:
+                self.pages.pop(next_page, None)
+                await log.error(e)
+                return
 
-            # protection for if the movie has no runtime
+    async def render_page(self, page_number: int):
+        # returns the embed fields and poster link of the page.
+        # someone is waiting on the page, or soon will be, so its requests go ahead of collections and prewarming
+        scheduler.priority.set(scheduler.INTERACTIVE)
+        start = page_number * self.limit_per_page
+        with self.metrics.span('resolve'):
+            await self.resolve_window(start + self.limit_per_page + PREFETCH_MARGIN)
+
+        # every film that can land on this page now has its rating, so the ranking's order is final for it.
+        # later pages can only drop films ranked after this page's window, so this page stays valid
+        page = self.movies.page(start, self.limit_per_page)
+
+        poster_link = ''
+        if len(page) > 0:
+            with self.metrics.span('poster'):
+                poster_link = await asyncio.to_thread(scraper.load_poster, films.slug(page[0][0]))
+
+        score_column = ''
+        title_column = ''
+        rating_column = ''
+        for movie, data in page:
+            score = f"{data[0]}\n"
+            name = f"[{films.title(movie)}](https://www.letterboxd.com/film/{films.slug(movie)}/)\n"
+            rating = f"{float(data[1]):.2f}"
+            runtime = "?:??" if data[2] is None else f"{int(data[2]) // 60}:{(int(data[2]) % 60):02d}"
+
+            score_column += score
+            title_column += name
+            rating_column += f"{rating}  -  {runtime}\n"
+
+        fields = [("SCORE", score_column),
+                  ("TITLE", title_column),
+                  ("RATING & RUNTIME", rating_column)]
+        return fields, poster_link
+
+    async def rescore(self, present_scores: tuple, absent_scores: tuple):
+        # reuses the collected lists and resolved film data, so only the ranking is rebuilt
+        global active_collections
+
+        # same order as ScoringRules.get_rules(). The rules only change once the new ranking is built, so a
+        # failed rescore leaves the shown rules matching the shown ranking
+        rules = tuple(present_scores) + tuple(absent_scores)
+
+        # lists that were skipped for being worth 0 points are collected once they are worth something
+        plan = self.plan_lists(rules)
+        if len(plan) > 0:
+            self.loading_recalculation = True
+            await self.update_response()
+            active_collections += 1
             try:
-                my_runtime = int(my_runtime)
-            except:
-                my_runtime = None
-
-            if my_rating != 0.0:
-                self.movies[my_movie] = (self.movies[my_movie][0], my_rating, my_runtime)
-            else:
-                del self.movies[my_movie]
-
-        # loop this until we get a page that is fully populated with movies with ratings
-        trying = True
-        while trying:
-
-            self.poster_link = ''
-            start = self.current_page * self.limit_per_page
-            end = min(start + self.limit_per_page, len(self.movies) - 1)
-            i = 0
-            score_column = ''
-            title_column = ''
-            rating_column = ''
-
-            self.movies = dict(sorted(self.movies.items(), key=lambda x: (x[1][0], x[1][1]), reverse=True))
-
-            for movie, data in self.movies.items():
-                if i < start:
-                    i += 1
-                    continue
-                if i >= end:
-                    trying = False
-                    break
-                if data[1] == 0.0:
-                    await find_data_for_score(data[0])
-                    break
-
-                if self.poster_link == '':
-                    self.poster_link = lb_movie.movie_poster(movie[1])
-
-                score = f"{data[0]}\n"
-                name = f"[{movie[0]}](https://www.letterboxd.com/film/{movie[1]}/)\n"
-                rating = f"{float(data[1]):.2f}"
-                runtime = f"{int(data[2]) // 60}:{(int(data[2]) % 60):02d}"
-
-                # field bodies can't go over 1024 characters
-                # if (len(score) + len(score_column) >= 1024 or
-                #         len(name) + len(title_column) >= 1024 or
-                #         len(rating) + len(rating_column) >= 1024):
-                #     break
-
-                score_column += score
-                title_column += name
-                rating_column += f"{rating}  -  {runtime}\n"
-                i += 1
-
-        self.embed_fields_recommendation = [("SCORE", score_column),
-                                            ("TITLE", title_column),
-                                            ("RATING & RUNTIME", rating_column)]
+                await self.collect_lists(plan)
+            finally:
+                active_collections -= 1
+            for column, users in plan.items():
+                self.scoring_matrix.add_lists(column, users)
+            self.free_lists()
+
+        movies = Ranking()
+        for movie, score in self.scoring_matrix.scored_films(rules):
+            # films missing from the old ranking were dropped for having no rating
+            if movie in self.movies:
+                movies.add(movie, score, self.movies[movie][1], self.movies[movie][2])
+        self.movies = movies
+        self.scoring_rules.change_rules(present_scores, absent_scores)
+
+        # every rendered page belongs to the old ranking
+        if self.prefetch_task is not None:
+            self.prefetch_task.cancel()
+        for task in self.pages.values():
+            task.cancel()
+        self.pages = {}
 
+        self.current_page = 0
         self.total_pages = int(math.ceil(len(self.movies) / self.limit_per_page))
+        await self.view_final.update_buttons()
 
-        self.recommendations_done = True
-        self.loading_recalculation = False
-        await self.update_response()
+    async def close(self):
+        # ends the recommendation: removes its buttons and frees everything it collected
+        if self.closed:
+            return
+        self.closed = True
+        sessions.release(self.guild_id, self)
+
+        if self.prefetch_task is not None:
+            self.prefetch_task.cancel()
+        for task in self.pages.values():
+            task.cancel()
+        if self.initiator is not None:
+            self.view_attendance.stop()
+            self.view_final.stop()
+
+            # one last edit so the message no longer shows buttons that do nothing
+            await self.update_response()
+
+        self.pages = {}
+        self.movies = Ranking()
+        self.scoring_matrix = None
+        self.free_lists()
+
+    def free_lists(self):
+        for user in self.users:
+            user.watchlist = films.intern_list([])
+            user.watched_movies = films.intern_list([])
+            user.liked_movies = films.intern_list([])
+
+    def memory_footprint(self):
+        # a rough estimate in bytes of the data this recommendation holds
+        size = 0
+        for user in self.users:
+            size += sys.getsizeof(user.watchlist) + sys.getsizeof(user.watched_movies)
+            size += sys.getsizeof(user.liked_movies)
+        if self.scoring_matrix is not None:
+            size += self.scoring_matrix.counts.nbytes + self.scoring_matrix.films.nbytes
+        size += self.movies.memory_footprint()
+        return size
+
+    def set_movie_data(self, movie, movie_data: dict):
+        # another page turn may have already resolved and dropped this film
+        if movie not in self.movies:
+            return
+        if movie_data['rating'] != 0.0:
+            self.movies.update(movie, rating=movie_data['rating'], runtime=movie_data['runtime'])
+        else:
+            self.movies.remove(movie)
+
+    async def resolve_window(self, end: int):
+        # films are ordered by score then rating, so every film sharing a score with one of the first `end` films
+        # needs its rating before those films can be ordered. Films without ratings get removed, which can pull
+        # more scores into the window, hence the loop
+        semaphore = asyncio.Semaphore(METADATA_CONCURRENCY)
+
+        async def find_movie_data(my_movie):
+            async with semaphore:
+                try:
+                    movie_data = await asyncio.to_thread(scraper.load_film, films.slug(my_movie),
+                                                         films.title(my_movie))
+                except Exception as e:
+                    await log.error(f"Could not find data for {films.slug(my_movie)}: {e}")
+                    movie_data = {'rating': 0.0, 'runtime': None}
+            self.set_movie_data(my_movie, movie_data)
+
+        while True:
+            needed = []
+            for score, group in self.movies.groups(end):
+                needed += [movie for movie in group if self.movies[movie][1] == 0.0]
+
+            if len(needed) == 0:
+                return
+            await asyncio.gather(*(find_movie_data(movie) for movie in needed))
 
     async def mark_attendance(self, value=None, recursive=False):
+        global active_collections
+
         working = True
         while working and value is not None:
             self.users[self.active_account_index].attendance_value = value
@@ -354,26 +651,56 @@ class Recommendation:
 
         if self.attendance_done:
             self.taking_attendance = False
+            # editing the message to another view doesn't stop this one, and its timeout would close the session
+            if self.view_attendance is not None:
+                self.view_attendance.stop()
 
             if len(self.present_users) < 1:
                 self.embed_desc_gathering += f"\nCannot recommend anything since there are no present linked members"
-                await self.update_response()
+                await self.close()
                 return
 
-            await self.collect_movies()
+            active_collections += 1
+            try:
+                await self.collect_movies()
+            except Exception:
+                # the attendance view is already stopped and the final one never shown, so nothing else would
+                # ever close this recommendation
+                await self.close()
+                raise
+            finally:
+                active_collections -= 1
 
         await self.update_response()
 
 
+def load_film_ids(username: str, list_type: str, deadline=None):
+    # blocking, so only call this from a worker thread. Interning here keeps the (title, slug) tuples off the
+    # event loop and lets them be freed as soon as the list is loaded
+    return films.intern_list(scraper.load_list(username, list_type, deadline))
+
+
+def load_watched_ids(username: str, among: list, deadline=None):
+    # blocking, so only call this from a worker thread
+    return films.intern_list(scraper.load_watched_among(username, among, deadline))
+
+
+def film_tuples(film_ids) -> list:
+    return [(films.title(movie), films.slug(movie)) for movie in film_ids]
+
+
 # Views are defined down here so that the required Recommendation is already defined
 class AttendanceView(discord.ui.View):
     def __init__(self, parent: Recommendation):
-        super().__init__()
+        super().__init__(timeout=sessions.SESSION_TIMEOUT)
         self.parent = parent
         self.initiator = parent.initiator
 
         self.apply_to_all = False
 
+    async def on_timeout(self):
+        await self.parent.close()
+
     @discord.ui.button(label="PRESENT", style=discord.ButtonStyle.green)
     async def present_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         await interaction.response.defer()
@@ -408,10 +735,13 @@ class AttendanceView(discord.ui.View):
 
 class FinalView(discord.ui.View):
     def __init__(self, parent: Recommendation):
-        super().__init__()
+        super().__init__(timeout=sessions.SESSION_TIMEOUT)
         self.parent = parent
         self.initiator = parent.initiator
 
+    async def on_timeout(self):
+        await self.parent.close()
+
     @discord.ui.button(label="|<", style=discord.ButtonStyle.green, disabled=True)
     async def first_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         await interaction.response.defer()
@@ -446,6 +776,13 @@ class FinalView(discord.ui.View):
         self.parent.current_page = self.parent.total_pages - 1
         await self.update_buttons()
 
+    @discord.ui.button(label="SCORING", style=discord.ButtonStyle.blurple)
+    async def scoring_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if interaction.user != self.initiator.user:
+            await interaction.response.defer()
+            return
+        await interaction.response.send_modal(ScoringModal(self.parent))
+
     async def update_buttons(self):
         self.first_button.disabled = False
         self.previous_button.disabled = False
@@ -460,5 +797,35 @@ class FinalView(discord.ui.View):
             self.last_button.disabled = True
             self.next_button.disabled = True
 
-        self.parent.loading_recalculation = True
         await self.parent.calculate_recommendation()
+
+
+class ScoringModal(discord.ui.Modal, title="Change Scoring Rules"):
+    present_scores = discord.ui.TextInput(label="Present: watchlist, watched, liked")
+    absent_scores = discord.ui.TextInput(label="Absent: watchlist, watched, liked")
+
+    def __init__(self, parent: Recommendation):
+        super().__init__()
+        self.parent = parent
+
+        rules = parent.scoring_rules.get_rules()
+        self.present_scores.default = f"{rules[0]}, {rules[1]}, {rules[2]}"
+        self.absent_scores.default = f"{rules[3]}, {rules[4]}, {rules[5]}"
+
+    async def on_submit(self, interaction: discord.Interaction):
+        try:
+            present = tuple(int(score) for score in self.present_scores.value.split(","))
+            absent = tuple(int(score) for score in self.absent_scores.value.split(","))
+        except ValueError:
+            present = absent = ()
+        if len(present) != 3 or len(absent) != 3:
+            await interaction.response.send_message(f'Scores must be three whole numbers separated by commas',
+                                                    ephemeral=True)
+            return
+        if any(abs(score) > MAX_RULE_SCORE for score in present + absent):
+            await interaction.response.send_message(f'Scores must be between -{MAX_RULE_SCORE} and {MAX_RULE_SCORE}',
+                                                    ephemeral=True)
+            return
+
+        await interaction.response.defer()
+        await self.parent.rescore(present, absent)
@@ -0,0 +1,99 @@
+# scheduler.py
+
+import os
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv('.env')
+# requests per second sent to letterboxd.com across the whole bot
+RATE = float(os.getenv('LETTERBOXD_RATE', 10))
+# requests that can be sent at once after a quiet spell
+BURST = float(os.getenv('LETTERBOXD_BURST', 20))
+
+# priority classes, lower goes first
+INTERACTIVE = 0
+COLLECTION = 1
+BACKGROUND = 2
+
+# the class of the requests made by the current task. asyncio.to_thread copies the context, so it follows the
+# task onto the scraping worker threads
+priority = contextvars.ContextVar('priority', default=COLLECTION)
+
+# all of the scheduler's state is shared between the worker threads and guarded by this condition
+condition = threading.Condition()
+# (priority, ticket) of every request waiting for a token, the first is the next to go
+waiting = []
+tickets = itertools.count()
+tokens = BURST
+refilled_at = time.monotonic()
+
+# key: Flight of the fetch currently running for it
+flights = {}
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def refill():
+    global tokens
+    global refilled_at
+
+    now = time.monotonic()
+    tokens = min(BURST, tokens + (now - refilled_at) * RATE)
+    refilled_at = now
+
+
+def acquire():
+    # blocks until the token bucket lets a request through and no request of a higher class is waiting
+    global tokens
+
+    entry = (priority.get(), next(tickets))
+    with condition:
+        heapq.heappush(waiting, entry)
+        while True:
+            refill()
+            if waiting[0] == entry and tokens >= 1:
+                heapq.heappop(waiting)
+                tokens -= 1
+                # the next request in line may be able to go as well
+                condition.notify_all()
+                return
+            # only the first in line needs to wake up on its own, when its token will have refilled
+            condition.wait(None if waiting[0] != entry else (1 - tokens) / RATE)
+
+
+def single_flight(key, function, *args):
+    # runs function(*args), unless a call with the same key is already running, in which case that call's result
+    # is shared instead of doing the same work twice
+    with condition:
+        flight = flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = flights[key] = Flight()
+
+    if not leader:
+        metrics.count('deduplicated_fetches')
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = function(*args)
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with condition:
+            del flights[key]
+        flight.done.set()
@@ -0,0 +1,52 @@
+# scoring.py
+
+import numpy as np
+
+# column order matches ScoringRules.get_rules()
+LIST_COLUMNS = (('present', 'watchlist'), ('present', 'watched_movies'), ('present', 'liked_movies'),
+                ('absent', 'watchlist'), ('absent', 'watched_movies'), ('absent', 'liked_movies'))
+
+
+def as_ids(film_ids) -> np.ndarray:
+    # the users' arrays of film ids, viewed without copying
+    return np.frombuffer(film_ids, dtype=np.uint32) if len(film_ids) > 0 else np.zeros(0, dtype=np.uint32)
+
+
+class ScoringMatrix:
+    # for every film that can be recommended (the union of the present users' watchlists), counts how many
+    # present and absent users have it on each of their lists. A film's score is then its row of counts times the
+    # scoring rules, so scoring every film is one matrix-vector product and rescoring never revisits the lists
+    def __init__(self, present_users: list, absent_users: list):
+        # sorted film ids of the candidates, a film's row is its position in here
+        self.films = np.unique(np.concatenate([as_ids(user.watchlist) for user in present_users]
+                                              + [np.zeros(0, dtype=np.uint32)]))
+
+        self.counts = np.zeros((len(self.films), len(LIST_COLUMNS)), dtype=np.int32)
+        users = {'present': present_users, 'absent': absent_users}
+        for column, (attendance, list_name) in enumerate(LIST_COLUMNS):
+            self.add_lists(column, users[attendance])
+
+    def add_lists(self, column: int, users: list):
+        # counts the users' lists into a column, lists that weren't collected are empty and count nothing
+        list_name = LIST_COLUMNS[column][1]
+        for user in users:
+            # a film only counts once per user, and films outside the candidates can never score
+            rows = self.rows(np.unique(as_ids(getattr(user, list_name))))
+            self.counts[rows, column] += 1
+
+    def __len__(self):
+        return len(self.films)
+
+    def rows(self, film_ids: np.ndarray) -> np.ndarray:
+        # rows of the given films, leaving out films that aren't candidates
+        rows = np.searchsorted(self.films, film_ids)
+        found = rows < len(self.films)
+        found[found] = self.films[rows[found]] == film_ids[found]
+        return rows[found]
+
+    def scores(self, rules: tuple) -> np.ndarray:
+        return self.counts @ np.asarray(rules, dtype=np.int32)
+
+    def scored_films(self, rules: tuple):
+        # (film id, score) for every candidate film
+        return zip(self.films.tolist(), self.scores(rules).tolist())
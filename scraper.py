@@ -0,0 +1,225 @@
+# scraper.py
+
+import os
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+from letterboxdpy import movie as lb_movie
+import cache
+import metrics
+import transport
+import scheduler
+
+load_dotenv('.env')
+# seconds between full rescrapes of a list, which catch films removed since the last full scrape
+FULL_SYNC_INTERVAL = float(os.getenv('FULL_SYNC_INTERVAL', 7 * 24 * 60 * 60))
+# only changed to point the scraper at a local copy of the site, like the benchmark does
+LETTERBOXD_URL = os.getenv('LETTERBOXD_URL', 'https://letterboxd.com')
+# pages a list is assumed to have when it has never been scraped, for deciding whether checking films one by one
+# is cheaper than scraping the list
+UNKNOWN_LIST_PAGES = int(os.getenv('UNKNOWN_LIST_PAGES', 10))
+# most list pages fetched from letterboxd.com at the same time, across every list being scraped
+PAGE_CONCURRENCY = int(os.getenv('LIST_PAGE_CONCURRENCY', 4))
+
+# films on one page of a list
+LIST_PAGE_SIZE = 72
+
+# the pages of a list after the first are fetched on these threads
+page_pool = ThreadPoolExecutor(max_workers=PAGE_CONCURRENCY, thread_name_prefix='list_page')
+
+# letterboxdpy's film pages go through the shared session as well
+transport.install(lb_movie)
+
+# all of these lists are ordered newest first by default, which is what the incremental sync relies on
+LIST_PATHS = {'watchlist': 'watchlist',
+              'watched': 'films',
+              'liked': 'likes/films'}
+
+
+def get_parsed_page(url: str) -> BeautifulSoup:
+    metrics.count_request()
+    response = transport.get(url)
+    return BeautifulSoup(response.text, 'lxml')
+
+
+def list_page_url(username: str, list_type: str, page: int) -> str:
+    return f"{LETTERBOXD_URL}/{username}/{LIST_PATHS[list_type]}/page/{page}/"
+
+
+def parse_films(page: BeautifulSoup) -> list:
+    # same (title, slug) tuples that letterboxdpy's list functions return
+    films = []
+    for img in page.find_all('img', {'class': ['image']}):
+        slug = img.parent.get('data-film-slug')
+        if slug is not None:
+            films.append((img['alt'], slug))
+    return films
+
+
+def check_deadline(deadline):
+    # deadline is a time.monotonic() time. A scrape that runs past it stops before its next request instead of
+    # carrying on in the background after whoever wanted it has given up
+    if deadline is not None and time.monotonic() > deadline:
+        raise TimeoutError("Scrape ran past its deadline")
+
+
+def scrape_page(username: str, list_type: str, page: int, deadline=None) -> list:
+    check_deadline(deadline)
+    return parse_films(get_parsed_page(list_page_url(username, list_type, page)))
+
+
+def page_count(page: BeautifulSoup) -> int:
+    # the last page number in a list page's pagination, or 1 if the list is short enough to have none
+    numbers = [link.text.strip() for link in page.select('div.paginate-pages li.paginate-page a')]
+    return max((int(number) for number in numbers if number.isdigit()), default=1)
+
+
+def full_list(username: str, list_type: str, deadline=None) -> list:
+    # the first page tells how many pages there are, the rest are then fetched at the same time
+    check_deadline(deadline)
+    first_page = get_parsed_page(list_page_url(username, list_type, 1))
+    pages = [parse_films(first_page)]
+    if len(pages[0]) == 0:
+        return []
+
+    last = page_count(first_page)
+    # the worker threads don't inherit the context, which carries the request priority
+    futures = [page_pool.submit(contextvars.copy_context().run, scrape_page, username, list_type, page, deadline)
+               for page in range(2, last + 1)]
+    try:
+        pages += [future.result() for future in futures]
+    except Exception:
+        # don't leave the pages that haven't started queued up for nothing
+        for future in futures:
+            future.cancel()
+        raise
+
+    # a last page as full as the first might not be the end, if films were added since page 1 was fetched or
+    # the list has no pagination, so carry on one page at a time until a page comes back empty
+    while len(pages[-1]) >= len(pages[0]):
+        last += 1
+        pages.append(scrape_page(username, list_type, last, deadline))
+
+    return [film for page_films in pages for film in page_films]
+
+
+def sync_list(username: str, list_type: str, known: list, deadline=None) -> list:
+    # only scrape pages until one contains a film we already know about, then put the new films in front
+    known_slugs = set(film[1] for film in known)
+    new_films = []
+    page = 1
+    while True:
+        page_films = scrape_page(username, list_type, page, deadline)
+
+        # ran off the end of the list without reaching a known film, so this is the complete list
+        if len(page_films) == 0:
+            return new_films
+
+        unknown = [film for film in page_films if film[1] not in known_slugs]
+        new_films += unknown
+        if len(unknown) < len(page_films):
+            return new_films + known
+        page += 1
+
+
+def load_list(username: str, list_type: str, deadline=None) -> list:
+    # blocking, so only call this from a worker thread
+    films = cache.get_list(username, list_type)
+    if films is not None:
+        return films
+    # two recommendations wanting the same list at once scrape it once
+    return scheduler.single_flight(('list', username.lower(), list_type), refresh_list, username, list_type,
+                                   deadline)
+
+
+def refresh_list(username: str, list_type: str, deadline=None) -> list:
+    # scrapes the list no matter how fresh the cached copy is
+    snapshot = cache.get_snapshot(username, list_type)
+    if snapshot is not None and time.time() - snapshot['full_sync_at'] < FULL_SYNC_INTERVAL:
+        films = sync_list(username, list_type, snapshot['films'], deadline)
+        cache.put_list(username, list_type, films, full_sync=False)
+    else:
+        films = full_list(username, list_type, deadline)
+        cache.put_list(username, list_type, films, full_sync=True)
+    return films
+
+
+def scrape_cost(username: str, list_type: str) -> int:
+    # roughly how many pages loading the list would request right now
+    snapshot = cache.get_snapshot(username, list_type)
+    if snapshot is None:
+        return UNKNOWN_LIST_PAGES
+    if time.time() - snapshot['fetched_at'] < cache.PROFILE_TTL:
+        return 0
+    if time.time() - snapshot['full_sync_at'] < FULL_SYNC_INTERVAL:
+        # an incremental sync usually stops on the first page
+        return 1
+    return len(snapshot['films']) // LIST_PAGE_SIZE + 1
+
+
+def has_watched(username: str, slug: str) -> bool:
+    # a member's page for a film only exists if they have watched it
+    metrics.count_request()
+    response = transport.get(f"{LETTERBOXD_URL}/{username}/film/{slug}/")
+    if response.status_code == 404:
+        return False
+    response.raise_for_status()
+    return True
+
+
+def load_watched_among(username: str, films: list, deadline=None) -> list:
+    # blocking, so only call this from a worker thread.
+    # the films out of `films` that the member has watched. When there are fewer films to check than pages
+    # in their watched history, each film is checked on its own instead of scraping the history
+    if len(films) >= scrape_cost(username, 'watched'):
+        slugs = set(film[1] for film in films)
+        return [film for film in load_list(username, 'watched', deadline) if film[1] in slugs]
+
+    watched = []
+    for film in films:
+        check_deadline(deadline)
+        if has_watched(username, film[1]):
+            watched.append(film)
+    return watched
+
+
+def load_film(slug: str, title: str) -> dict:
+    # blocking, so only call this from a worker thread
+    film = cache.get_films([slug]).get(slug)
+    if film is not None:
+        return film
+
+    metrics.count_request()
+    movie_data = lb_movie.Movie(slug)
+    rating = movie_data.rating.split()[0]
+    runtime = movie_data.runtime
+
+    # protection for if the movie has no rating
+    try:
+        rating = float(rating)
+    except:
+        rating = float(0)
+
+    # protection for if the movie has no runtime
+    try:
+        runtime = int(runtime)
+    except:
+        runtime = None
+
+    # films without a rating are stored too, so they aren't fetched again only to be thrown out
+    cache.put_film(slug, title, rating, runtime)
+    return {'title': title, 'rating': rating, 'runtime': runtime, 'poster': None}
+
+
+def load_poster(slug: str) -> str:
+    # blocking, so only call this from a worker thread
+    film = cache.get_films([slug]).get(slug)
+    if film is not None and film['poster'] is not None:
+        return film['poster']
+
+    metrics.count_request()
+    poster = lb_movie.movie_poster(slug)
+    cache.put_poster(slug, poster)
+    return poster
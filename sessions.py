@@ -0,0 +1,46 @@
+# sessions.py
+
+import os
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv('.env')
+# most recommendations a single guild can have open at once
+MAX_PER_GUILD = int(os.getenv('MAX_RECOMMENDATIONS_PER_GUILD', 2))
+# seconds without a button press before a recommendation is closed and its data freed
+SESSION_TIMEOUT = float(os.getenv('RECOMMENDATION_TIMEOUT', 15 * 60))
+
+# guild id: open Recommendations
+active = {}
+
+
+def count() -> int:
+    return sum(len(recommendations) for recommendations in active.values())
+
+
+def can_start(guild_id: int, max_total: int) -> bool:
+    return count() < max_total and len(active.get(guild_id, [])) < MAX_PER_GUILD
+
+
+def register(guild_id: int, recommendation):
+    active.setdefault(guild_id, []).append(recommendation)
+    update_gauges()
+
+
+def release(guild_id: int, recommendation):
+    if recommendation in active.get(guild_id, []):
+        active[guild_id].remove(recommendation)
+        if len(active[guild_id]) == 0:
+            del active[guild_id]
+    update_gauges()
+
+
+def stats() -> dict:
+    footprint = sum(recommendation.memory_footprint()
+                    for recommendations in active.values() for recommendation in recommendations)
+    return {'sessions': count(), 'guilds': len(active), 'memory_bytes': footprint}
+
+
+def update_gauges():
+    for name, value in stats().items():
+        metrics.set_gauge(f"recommendation_{name}", value)
@@ -0,0 +1,92 @@
+# transport.py
+
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+import cache
+import metrics
+import scheduler
+
+load_dotenv('.env')
+# most connections kept open to one host, which should cover every scraping worker thread at once
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 16))
+# seconds to wait for letterboxd.com to connect or send data
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 30))
+
+HEADERS = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+                         '(KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+           'Accept-Encoding': 'gzip, deflate'}
+
+# one session for every Letterboxd fetch, so pages reuse kept-alive connections instead of each paying for a new
+# TCP and TLS handshake. Sessions are safe to share between the scraping worker threads for plain GETs
+session = requests.Session()
+session.headers.update(HEADERS)
+adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, pool_block=True)
+session.mount('https://', adapter)
+session.mount('http://', adapter)
+
+
+def get(url: str, params=None, **kwargs) -> requests.Response:
+    # fetches of a page that is already being fetched wait for that fetch and share its response
+    if params is not None:
+        return fetch(url, params, **kwargs)
+    return scheduler.single_flight(('get', url), lambda: fetch(url, None, **kwargs))
+
+
+def fetch(url: str, params=None, **kwargs) -> requests.Response:
+    # a GET through the shared session, once the scheduler lets it go. Pages fetched before are revalidated with
+    # their ETag / Last-Modified, and when letterboxd.com answers 304 Not Modified the stored copy is returned as
+    # if it had been sent again
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    headers = dict(kwargs.pop('headers', None) or {})
+    # letterboxdpy sends its own user agent, keep the session's so every request looks the same
+    headers.pop('User-Agent', None)
+
+    stored = cache.get_response(url) if params is None else None
+    if stored is not None:
+        if stored['etag'] is not None:
+            headers['If-None-Match'] = stored['etag']
+        if stored['last_modified'] is not None:
+            headers['If-Modified-Since'] = stored['last_modified']
+
+    scheduler.acquire()
+    response = session.get(url, params=params, headers=headers, **kwargs)
+
+    if response.status_code == 304 and stored is not None:
+        metrics.count('http_not_modified')
+        return stored_response(url, stored)
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if params is None and response.status_code == 200 and (etag is not None or last_modified is not None):
+        cache.put_response(url, etag, last_modified, response.headers.get('Content-Type'), response.encoding,
+                           response.content)
+    return response
+
+
+def stored_response(url: str, stored: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response._content = stored['body']
+    response.encoding = stored['encoding']
+    if stored['content_type'] is not None:
+        response.headers['Content-Type'] = stored['content_type']
+    return response
+
+
+class RequestsModule:
+    # stands in for the requests module inside letterboxdpy, so its pages go through the shared session too
+    def get(self, url, params=None, **kwargs):
+        return get(url, params, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+def install(*modules):
+    # points the letterboxdpy modules' `requests` at the shared session
+    for module in modules:
+        if hasattr(module, 'requests'):
+            module.requests = RequestsModule()